@@ -0,0 +1,8 @@
+import sys
+
+from dstl_waterways.batch import main
+
+# command line entry point, see dstl_waterways/batch.py
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic import synthetic_scene, write_scene
+
+# Per-stage benchmarks on a synthetic full-size scene.
+#
+#   python -m benchmarks.run                       # print the table
+#   python -m benchmarks.run --save baseline       # also store benchmarks/baselines/baseline.json
+#   python -m benchmarks.run --compare baseline    # report stages slower than the baseline
+#
+# Each stage is timed as the best of --repeat runs, then run once more under
+# tracemalloc for its peak allocation. Throughput is in megapixels of the
+# grid the stage works on per second.
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+IMAGE_ID = 'bench_0_0'
+
+
+def _render(ctx):
+    # the 5 panel mask figure of display(), rendered off screen
+    import io
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fig, axes = plt.subplots(ncols=5, nrows=1, figsize=(16, 4))
+    for ax, name in zip(axes.ravel(), ['CCCI_NIR2', 'NDWI', 'NDVI', 'FAUX_CCCI', 'CCCI_SWIR']):
+        ax.imshow(ctx['masks'][name], cmap='binary_r')
+        ax.axis('off')
+    plt.tight_layout()
+    fig.savefig(io.BytesIO(), format='png')
+    plt.close(fig)
+
+
+def _quicklook(ctx):
+    # the same panels through the lookup-table renderer
+    import io
+    from dstl_waterways.render import quicklook, write_png
+    write_png(io.BytesIO(), quicklook(ctx['rgb'], [ctx['masks'][name] for name in sorted(ctx['masks'])]))
+
+
+def build_stages(ctx):
+    # [(name, grid pixels, callable)], run in order; ctx holds the scene and
+    # the outputs later stages work on
+    from skimage.transform import resize
+    from dstl_waterways.bands import WV3ms
+    from dstl_waterways.indices import INDICES, Workspace, compute_indices
+    from dstl_waterways.masks import ccci_mask, clean_mask
+    from dstl_waterways.quantize import quantize_index
+    from dstl_waterways.scene import Scene
+    from dstl_waterways.stretch import stretch_01
+
+    scene, m, a, rgb = ctx['scene'], ctx['m'], ctx['a'], ctx['rgb']
+    ms_pixels = m.shape[1] * m.shape[2]
+    rgb_pixels = rgb.shape[0] * rgb.shape[1]
+
+    def read():
+        s = Scene(scene.image_id, scene.data_dir)
+        for product in ('RGB', 'P', 'M', 'A'):
+            np.array(s.product(product))
+
+    stages = [
+        ('read', rgb_pixels, read),
+        ('resize', rgb_pixels,
+         lambda: resize(m[WV3ms.NEARIR2.value], rgb.shape[:2], mode='constant')),
+    ]
+    for name in INDICES:
+        pixels = rgb_pixels if name == 'FAUX_CCCI' else ms_pixels
+        stages.append(('index_' + name, pixels,
+                       lambda name=name: compute_indices(m, [name], swirdata=a, rgbdata=rgb)))
+    workspace = Workspace()
+    stages += [
+        ('indices_fused', rgb_pixels, lambda: compute_indices(m, swirdata=a, rgbdata=rgb)),
+        # intermediates reused from the previous run, as in a batch worker
+        ('indices_workspace', rgb_pixels, lambda: compute_indices(m, swirdata=a, rgbdata=rgb, workspace=workspace)),
+        # resampled bands resized in float32 and kept in float16
+        ('indices_float16', rgb_pixels, lambda: compute_indices(m, swirdata=a, rgbdata=rgb, precision='float16')),
+        ('quantize', rgb_pixels, lambda: quantize_index('FAUX_CCCI', ctx['indices']['FAUX_CCCI'], 'int16')),
+        ('stretch', rgb_pixels, lambda: stretch_01(rgb)),
+        ('morphology', ms_pixels, lambda: ccci_mask(ctx['indices']['CCCI_NIR2'])),
+        ('components', ms_pixels, lambda: clean_mask(ctx['indices']['NDWI'] > 0.07, min_elongation=3)),
+        ('histogram', ms_pixels, lambda: np.histogram(ctx['indices']['CCCI_NIR2'], range=(-2, 2), bins=50)),
+        ('render', rgb_pixels, lambda: _render(ctx)),
+        ('quicklook', rgb_pixels, lambda: _quicklook(ctx)),
+    ]
+    return stages
+
+
+def run_stages(stages, repeat=3):
+    results = {}
+    for name, pixels, func in stages:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {
+            'seconds': best,
+            'mpix_per_s': pixels / 1e6 / best,
+            'peak_mb': peak / 2.0 ** 20,
+        }
+        print('{:<22} {:>9.4f}s {:>10.1f} MP/s {:>9.1f} MB'.format(
+            name, best, results[name]['mpix_per_s'], results[name]['peak_mb']))
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    # names of the stages more than tolerance (a fraction) slower than baseline
+    slower = []
+    print('\n{:<22} {:>10} {:>10} {:>8}'.format('stage', 'baseline', 'now', 'ratio'))
+    for name, result in results.items():
+        if name not in baseline['stages']:
+            continue
+        before = baseline['stages'][name]['seconds']
+        ratio = result['seconds'] / before
+        flag = '  REGRESSION' if ratio > 1 + tolerance else ''
+        print('{:<22} {:>9.4f}s {:>9.4f}s {:>7.2f}x{}'.format(name, before, result['seconds'], ratio, flag))
+        if flag:
+            slower.append(name)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every pipeline stage on a synthetic WV-3 scene.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scale', type=int, default=1, help='shrink the scene by this factor for quick runs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help='run only these stages')
+    parser.add_argument('--save', metavar='NAME', help='store the results as baselines/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='compare against baselines/NAME.json')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='slowdown, as a fraction, reported as a regression')
+    args = parser.parse_args(argv)
+
+    from dstl_waterways.indices import compute_indices
+    from dstl_waterways.masks import compute_masks
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        products = synthetic_scene(args.seed, args.scale)
+        scene = write_scene(data_dir, IMAGE_ID, products)
+        ctx = {'scene': scene, 'm': products['M'], 'a': products['A'],
+               'rgb': np.ascontiguousarray(np.moveaxis(products['RGB'], 0, -1))}
+        ctx['indices'] = compute_indices(ctx['m'], swirdata=ctx['a'], rgbdata=ctx['rgb'])
+        ctx['masks'] = compute_masks(ctx['indices'])
+
+        stages = [s for s in build_stages(ctx) if not args.only or s[0] in args.only]
+        results = run_stages(stages, args.repeat)
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print('peak RSS {:.1f} MB'.format(peak_rss_mb))
+
+    record = {
+        'meta': {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'seed': args.seed,
+            'scale': args.scale,
+            'peak_rss_mb': peak_rss_mb,
+        },
+        'stages': results,
+    }
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, args.save + '.json'), 'w') as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, args.compare + '.json')) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('scale') != args.scale:
+            print('warning: baseline was run at scale {}'.format(baseline['meta'].get('scale')))
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import tifffile as tiff
+from scipy import ndimage
+
+from dstl_waterways.bands import WV3ms
+
+# Deterministic synthetic WorldView-3 scenes with the shapes and dtypes of
+# the DSTL data (see dstl_waterways/bands.py), for benchmarking without the real imagery.
+# A sinuous river runs across the scene with water-like spectra (green up,
+# near infra red down) so the water masks are not empty.
+
+SHAPES = {
+    'RGB': (3, 3350, 3338),
+    'P': (3349, 3338),
+    'M': (8, 838, 835),
+    'A': (8, 134, 133),
+}
+
+MAX_VALUE = 2047    # 11 bit
+
+
+def _field(rng, shape, cells=24):
+    # smooth random field in [0, 1]
+    coarse = rng.random((cells, cells))
+    return ndimage.zoom(coarse, (shape[0] / cells, shape[1] / cells), order=1, grid_mode=True,
+                        mode='nearest')[:shape[0], :shape[1]]
+
+
+def _river(shape, width=0.02):
+    rows, cols = shape
+    y, x = np.mgrid[0:rows, 0:cols]
+    centre = rows * (0.5 + 0.2 * np.sin(x * 6.0 / cols))
+    return np.abs(y - centre) < width * rows
+
+
+def synthetic_scene(seed=0, scale=1):
+    # {product: uint16 array}; scale > 1 shrinks every grid by that factor
+    rng = np.random.default_rng(seed)
+    shape = lambda s: s[:-2] + (max(s[-2] // scale, 1), max(s[-1] // scale, 1))
+
+    m_shape = shape(SHAPES['M'])
+    water = _river(m_shape[1:])
+    m = np.empty(m_shape, dtype=np.float64)
+    for band in WV3ms:
+        m[band.value] = 300 + 900 * _field(rng, m_shape[1:])
+    m[WV3ms.GREEN.value][water] += 250
+    m[WV3ms.BLUE.value][water] += 150
+    m[WV3ms.NEARIR1.value][water] *= 0.3
+    m[WV3ms.NEARIR2.value][water] *= 0.25
+    m += rng.normal(0, 20, m.shape)
+
+    # the finer grids are the M bands repeated up (plus noise), the SWIR
+    # grid is a block mean of them
+    def up(band, out_shape):
+        reps = (-(-out_shape[0] // band.shape[0]), -(-out_shape[1] // band.shape[1]))
+        return np.kron(band, np.ones(reps))[:out_shape[0], :out_shape[1]]
+
+    rgb_shape = shape(SHAPES['RGB'])
+    rgb = np.stack([up(m[b.value], rgb_shape[1:])
+                    for b in (WV3ms.RED, WV3ms.GREEN, WV3ms.BLUE)])
+    rgb += rng.normal(0, 30, rgb.shape)
+    p = up(m[[WV3ms.RED.value, WV3ms.GREEN.value, WV3ms.BLUE.value]].mean(axis=0), shape(SHAPES['P']))
+    p += rng.normal(0, 30, p.shape)
+
+    a_shape = shape(SHAPES['A'])
+    a = np.stack([ndimage.zoom(m[band], (a_shape[1] / m_shape[1], a_shape[2] / m_shape[2]),
+                               order=1, grid_mode=True, mode='nearest')[:a_shape[1], :a_shape[2]]
+                  for band in range(8)]) * 0.8
+
+    as_uint16 = lambda x: np.clip(np.rint(x), 0, MAX_VALUE).astype(np.uint16)
+    return {'RGB': as_uint16(rgb), 'P': as_uint16(p), 'M': as_uint16(m), 'A': as_uint16(a)}
+
+
+def write_scene(data_dir, image_id, products):
+    # lays products out as three_band/ and sixteen_band/ so scene.Scene can read them
+    from dstl_waterways.scene import Scene
+    scene = Scene(image_id, data_dir)
+    for product, data in products.items():
+        path = scene.path(product)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tiff.imwrite(path, data)
+    return scene
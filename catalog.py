@@ -0,0 +1,8 @@
+import sys
+
+from dstl_waterways.catalog import main
+
+# command line entry point, see dstl_waterways/catalog.py
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+import importlib
+
+# Waterway detection on the DSTL WorldView-3 scenes: band enums, spectral
+# indices, stretches, masks and the scene loader, plus the batch, evaluation,
+# sweep and overview tools built on them (run as python -m dstl_waterways.batch
+# or through the batch.py, evaluate.py, sweep.py and overviews.py scripts).
+#
+#   from dstl_waterways import Scene, compute_indices, compute_masks
+#
+# Only numpy is imported up front. scipy and skimage are imported on the
+# first resize or morphology, tifffile on the first read, pandas and
+# matplotlib only by the tools that plot or read the training CSV, so
+# importing the package or starting a worker stays cheap. The names below
+# are resolved on first use for the same reason.
+
+_EXPORTS = {
+    'WV3ms': 'bands',
+    'WV3swir': 'bands',
+    'load_catalog': 'catalog',
+    'INDICES': 'indices',
+    'SAVI_L': 'indices',
+    'Workspace': 'indices',
+    'compute_index': 'indices',
+    'compute_indices': 'indices',
+    'MASKS': 'masks',
+    'ccci_mask': 'masks',
+    'compute_masks': 'masks',
+    'PIPELINE': 'pipeline',
+    'products_for': 'pipeline',
+    'Scene': 'scene',
+    'cut_points': 'stretch',
+    'stretch_01': 'stretch',
+    'stretch_uint8': 'stretch',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module('{}.{}'.format(__name__, _EXPORTS[name])), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
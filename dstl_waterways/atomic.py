@@ -0,0 +1,34 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+# Atomic file replacement for everything written where others may be reading:
+# the checkpoint, the catalog, the overview sidecars and the disk cache. The
+# data goes to a temporary file next to the final name, is synced to disk and
+# renamed over it, so readers (and a rerun after a crash) see either the old
+# file or the complete new one, never half of it.
+#
+#   with atomic_write(path, 'w') as f:
+#       json.dump(data, f)
+
+
+@contextmanager
+def atomic_write(path, mode='wb'):
+    # yields a file opened with mode ('w' or 'wb') that replaces path once the
+    # block completes; if the block raises, path is left alone and the
+    # temporary file removed
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,39 @@
+from enum import Enum
+
+# Worldview-3 - Panchromatic (3349, 3338): 400nm - 800nm
+
+# Worldview-3 RGB (3350, 3338)
+
+# Worldview-3 - 8 Multispectral bands (838, 835):
+# Coastal: 400 - 450 nm (0, QGIS: 1, WV-3-Band-no:2)     Red: 630 - 690 nm       (4, QGIS: 5, WV-3-Band-no:6)
+# Blue: 450 - 510 nm    (1, QGIS: 2, WV-3-Band-no:3)     Red Edge: 705 - 745 nm  (5, QGIS: 6, WV-3-Band-no:7)
+# Green: 510 - 580 nm   (2, QGIS: 3, WV-3-Band-no:4)     Near-IR1: 770 - 895 nm  (6, QGIS: 7, WV-3-Band-no:8)
+# Yellow: 585 - 625 nm  (3, QGIS: 4, WV-3-Band-no:5)     Near-IR2: 860 - 1040 nm (7, QGIS: 8, WV-3-Band-no:9)
+
+# Worldview-3 - 8 SWIR bands (134, 133):
+# SWIR-1: 1195 - 1225 nm    SWIR-5: 2145 - 2185 nm
+# SWIR-2: 1550 - 1590 nm    SWIR-6: 2185 - 2225 nm
+# SWIR-3: 1640 - 1680 nm    SWIR-7: 2235 - 2285 nm
+# SWIR-4: 1710 - 1750 nm    SWIR-8: 2295 - 2365 nm
+
+
+class WV3ms(Enum):
+    COASTAL = 0
+    BLUE = 1
+    GREEN = 2
+    YELLOW = 3
+    RED = 4
+    REDEDGE = 5
+    NEARIR1 = 6
+    NEARIR2 = 7
+
+
+class WV3swir(Enum):
+    SWIR_1 = 0
+    SWIR_2 = 1
+    SWIR_3 = 2
+    SWIR_4 = 3
+    SWIR_5 = 4
+    SWIR_6 = 5
+    SWIR_7 = 6
+    SWIR_8 = 7
@@ -0,0 +1,443 @@
+import argparse
+import os
+import sys
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from dstl_waterways import profiling
+from dstl_waterways.bitmask import BitMask
+from dstl_waterways.catalog import load_catalog
+from dstl_waterways.diskcache import DiskCache
+from dstl_waterways.histogram import (HISTOGRAM_BINS, load_histograms, merge_histograms, new_histograms,
+                                      save_histograms)
+from dstl_waterways.indices import INDICES, PRECISIONS, RESOLUTIONS, Workspace, grid_shape
+from dstl_waterways.manifest import MAX_ATTEMPTS, Checkpoint, checkpoint_path, parse_shard, shard_ids
+from dstl_waterways.masks import CLEANUPS, MASKS, MAX_HOLE_AREA, MIN_COMPONENT_AREA, MIN_ELONGATION
+from dstl_waterways.mosaic import HaloScene, mosaic_path, tile_position, write_mosaic
+from dstl_waterways.pipeline import PIPELINE
+from dstl_waterways.quantize import QUANTIZE_DTYPES, Quantized
+from dstl_waterways.render import quicklook as render_quicklook, write_png
+from dstl_waterways.resample import upsample_nearest
+from dstl_waterways.scene import Scene
+from dstl_waterways.tiling import process_tiled
+
+# Headless batch runner: computes index rasters and masks for many images
+# over a process pool and writes them as TIFFs, one image per task, so a
+# failing image is reported without stopping the rest of the run.
+#
+#   python batch.py --class-type 7 --out masks --workers 8
+#   python batch.py --ids 6080_4_3 6120_2_2 --indices NDWI CCCI_NIR2 --out masks
+
+# test images
+# take some pictures from test
+WATERWAY_TEST = ['6080_4_3', '6080_4_0',
+                 '6080_1_3', '6080_1_1',
+                 '6150_3_4', '6050_2_1']
+
+# intermediate arrays of the index computation, reused by every image a
+# process handles (each worker process handles one image at a time)
+_WORKSPACE = Workspace()
+
+
+def select_image_ids(csv_path='train_wkt_v4.csv', class_type=7, catalog=None):
+    # ImageIds with a non-empty polygon of the given class, or every ImageId
+    # with class_type=None, looked up in the catalog (see catalog.py) if one
+    # is given rather than read from the csv
+    if catalog is not None:
+        return catalog.image_ids(class_type)
+    import pandas as pd
+    data = pd.read_csv(csv_path)
+    if class_type is None:
+        return list(data.ImageId.unique())
+    data = data[data.MultipolygonWKT != 'MULTIPOLYGON EMPTY']
+    return list(data[data.ClassType == class_type].ImageId)
+
+
+def process_image(image_id, out_dir, masks=MASKS, indices=(), tile=None, data_dir='.', mask_format='tif',
+                  histograms=(), quicklook=False, resolution='native', upsample_masks=False, disk_cache=None,
+                  catalog=None, cleanup='morphology', min_area=MIN_COMPONENT_AREA, min_elongation=MIN_ELONGATION,
+                  max_hole_area=MAX_HOLE_AREA, mosaic=False, precision='float64', quantize=None):
+    # computes and writes {out_dir}/{image_id}_{mask}_mask.tif (uint8 0/1), or
+    # .npz bit-packed masks (see bitmask.py) with mask_format='npz',
+    # {out_dir}/{image_id}_{index}.tif (float32, or int16 / uint8 codes with
+    # quantize, see write_index), for the indices in
+    # histograms {out_dir}/{image_id}_histograms.npz (see histogram.py) and,
+    # with quicklook, a {out_dir}/{image_id}_quicklook.png of the RGB, the
+    # masks and the histograms (see render.py); returns the files written
+    # resolution picks the grid everything is computed on (see indices.py),
+    # and upsample_masks brings the masks to the RGB grid afterwards;
+    # disk_cache is a directory keeping index rasters between runs (see diskcache.py),
+    # and catalog the path of a catalog the products are opened through (see catalog.py)
+    # cleanup and the component limits pick how masks are cleaned up (see masks.CLEANUPS)
+    # with mosaic everything is computed with a halo borrowed from the
+    # neighbouring cells of the DSTL grid and cropped back (see mosaic.py)
+    # precision sets the dtypes of the resampled bands (see indices.PRECISIONS),
+    # and quantize keeps the index rasters as codes (see quantize.py)
+    catalog = load_catalog(catalog) if catalog else None
+    scene = Scene(image_id, data_dir, catalog)
+    if mosaic and (tile or histograms or disk_cache):
+        raise ValueError('mosaic processing works on whole scenes, without histograms or a disk cache')
+    if tile:
+        if cleanup == 'components':
+            raise ValueError('component cleanup needs whole masks, it cannot run tile by tile')
+        if precision != 'float64' or quantize:
+            raise ValueError('tiles are always computed in full precision')
+        hists = new_histograms(histograms)
+        results = process_tiled(image_id, masks, tile=tile, data_dir=data_dir, histograms=hists,
+                                workspace=_WORKSPACE, catalog=catalog)
+        index_rasters = {}
+    else:
+        source = HaloScene(image_id, data_dir, catalog) if mosaic else scene
+        # only the nodes behind the requested masks and indices are evaluated
+        outputs = PIPELINE.evaluate(list(indices) + [name + '_mask' for name in masks] +
+                                    [name + '_hist' for name in histograms],
+                                    {'scene': source},
+                                    {'workspace': _WORKSPACE, 'resolution': resolution,
+                                     'disk_cache': DiskCache(disk_cache) if disk_cache else None,
+                                     'cleanup': cleanup, 'MIN_COMPONENT_AREA': min_area,
+                                     'MIN_ELONGATION': min_elongation, 'MAX_HOLE_AREA': max_hole_area,
+                                     'precision': precision, 'quantize': quantize})
+        results = {name: outputs[name + '_mask'] for name in masks}
+        index_rasters = {name: outputs[name] for name in indices}
+        if mosaic:
+            results = {name: source.crop(mask) for name, mask in results.items()}
+            index_rasters = {name: source.crop(raster) for name, raster in index_rasters.items()}
+        hists = {name: outputs[name + '_hist'] for name in histograms}
+    if upsample_masks:
+        rgb_shape = scene.product('RGB').shape[1:]
+        results = {name: upsample_nearest(mask, rgb_shape) for name, mask in results.items()}
+
+    import tifffile as tiff
+    written = []
+    with profiling.stage('write'):
+        for name, mask in results.items():
+            path = mask_path(out_dir, image_id, name, mask_format)
+            if mask_format == 'npz':
+                BitMask.from_bool(mask).save(path)
+            else:
+                tiff.imwrite(path, mask.astype(np.uint8))
+            written.append(path)
+        for name in indices:
+            path = os.path.join(out_dir, '{}_{}.tif'.format(image_id, name))
+            write_index(path, index_rasters[name])
+            written.append(path)
+        if hists:
+            path = histograms_path(out_dir, image_id)
+            save_histograms(path, hists)
+            written.append(path)
+    if quicklook:
+        with profiling.stage('quicklook'):
+            path = os.path.join(out_dir, '{}_quicklook.png'.format(image_id))
+            write_png(path, render_quicklook(scene.rgb, list(results.values()),
+                                             [hist.counts for hist in hists.values()]))
+        written.append(path)
+    return written
+
+
+def write_index(path, raster):
+    # an index raster as a TIFF: float32, or for a quantize.Quantized its
+    # codes, with the scale and offset in the description (see read_index)
+    import tifffile as tiff
+    if isinstance(raster, Quantized):
+        tiff.imwrite(path, np.ascontiguousarray(raster.codes),
+                     metadata={'scale': raster.scale, 'offset': raster.offset})
+    else:
+        tiff.imwrite(path, np.ascontiguousarray(raster))
+
+
+def read_index(path):
+    # an index TIFF written by write_index: a float32 array, or a Quantized
+    import tifffile as tiff
+    with tiff.TiffFile(path) as tif:
+        data = tif.asarray()
+        metadata = tif.shaped_metadata[0] if tif.shaped_metadata else {}
+    if 'scale' in metadata:
+        return Quantized(data, metadata['scale'], metadata['offset'])
+    return data
+
+
+def mask_path(out_dir, image_id, name, mask_format='tif'):
+    return os.path.join(out_dir, '{}_{}_mask.{}'.format(image_id, name, mask_format))
+
+
+def write_mosaics(out_dir, image_ids, masks):
+    # {out_dir}/{grid}_{mask}_mosaic.tif of the TIFF masks written for
+    # image_ids, one per grid square and mask (see mosaic.write_mosaic)
+    grids = {}
+    for image_id in image_ids:
+        grids.setdefault(tile_position(image_id)[0], []).append(image_id)
+    written = []
+    for grid, grid_ids in sorted(grids.items()):
+        for name in masks:
+            tiles = {image_id: mask_path(out_dir, image_id, name) for image_id in grid_ids}
+            written.append(write_mosaic(mosaic_path(out_dir, grid, name), tiles))
+    return written
+
+
+def histograms_path(out_dir, image_id):
+    return os.path.join(out_dir, '{}_histograms.npz'.format(image_id))
+
+
+def merge_image_histograms(out_dir, image_ids):
+    # the per-image histograms written by process_image, added together
+    merged = {}
+    for image_id in image_ids:
+        merge_histograms(merged, load_histograms(histograms_path(out_dir, image_id)))
+    return merged
+
+
+def _run_one(image_id, out_dir, **options):
+    # worker entry point: never raises, returns (image_id, seconds, error or None)
+    start = time.perf_counter()
+    try:
+        with profiling.stage('image', image_id=image_id):
+            process_image(image_id, out_dir, **options)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return image_id, time.perf_counter() - start, error
+
+
+def _run_pool(image_ids, out_dir, workers, report, options, started=None):
+    # runs image_ids over one pool, calling started (if given) with each
+    # image once it is submitted and passing each result to report, with no
+    # more than workers images submitted at a time so that those in flight
+    # are the ones running. A worker that dies (killed, out of memory,
+    # crashed) breaks the pool and fails everything in it: returns (the
+    # images in flight then, the images not started yet), both empty when
+    # the pool survived
+    queue = deque(image_ids)
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while queue or in_flight:
+            while queue and len(in_flight) < workers:
+                try:
+                    future = pool.submit(_run_one, queue[0], out_dir, **options)
+                except BrokenProcessPool:
+                    return list(in_flight.values()), list(queue)
+                image_id = queue.popleft()
+                in_flight[future] = image_id
+                if started is not None:
+                    started(image_id)
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                image_id = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    return [image_id] + list(in_flight.values()), list(queue)
+                report(*result)
+    return [], []
+
+
+def run_batch(image_ids, out_dir, workers=None, checkpoint=None, **options):
+    # processes image_ids over a pool of worker processes and returns
+    # [(image_id, seconds, error or None)] in completion order; every result
+    # is also recorded in checkpoint (see manifest.py) as it comes in
+    os.makedirs(out_dir, exist_ok=True)
+    # imported once here rather than on the first image of every worker, which
+    # inherit them when the pool forks
+    import tifffile  # noqa: F401
+    from scipy import ndimage  # noqa: F401
+    from skimage.transform import resize  # noqa: F401
+    workers = workers or os.cpu_count() or 1
+    results = []
+
+    def report(image_id, seconds, error):
+        if error is None:
+            print('{} ok {:.2f}s'.format(image_id, seconds))
+        else:
+            print('{} FAILED {:.2f}s\n{}'.format(image_id, seconds, error), file=sys.stderr)
+        if checkpoint is not None:
+            checkpoint.record(image_id, seconds, error)
+        results.append((image_id, seconds, error))
+
+    # the attempt is counted on submission, so an image that takes the whole
+    # run down with it still counts towards --max-attempts
+    started = checkpoint.start if checkpoint is not None else None
+    pending = list(image_ids)
+    while pending:
+        interrupted, pending = _run_pool(pending, out_dir, workers, report, options, started)
+        # one of the images in flight killed its worker and took the others
+        # down with it: each is run again alone, in a pool of its own, to
+        # tell which, as part of the same attempt; the images not started yet
+        # carry on in a new pool
+        for image_id in interrupted:
+            start = time.perf_counter()
+            if _run_pool([image_id], out_dir, 1, report, options)[0]:
+                report(image_id, time.perf_counter() - start,
+                       'worker process died (killed, out of memory or crashed) processing {}'.format(image_id))
+    return results
+
+
+def _resolution(text):
+    # checked on the command line rather than in every worker
+    try:
+        grid_shape(text, (1, 1), (1, 1))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+
+def _shard(text):
+    try:
+        return parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _grid(image_id):
+    return tile_position(image_id)[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute waterway masks for many images without a display.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--ids', nargs='+', help='ImageIds to process')
+    source.add_argument('--class-type', type=int, help='process the ImageIds with polygons of this class in --csv')
+    source.add_argument('--test-set', action='store_true', help='process the hand-picked test images')
+    source.add_argument('--all', action='store_true', help='process every ImageId in --csv (or --catalog)')
+    parser.add_argument('--csv', default='train_wkt_v4.csv')
+    parser.add_argument('--data-dir', default='.', help='directory holding three_band/ and sixteen_band/')
+    parser.add_argument('--catalog', metavar='PATH', default=None,
+                        help='dataset catalog (see catalog.py) to select images and open products with')
+    parser.add_argument('--out', required=True, help='output directory')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--masks', nargs='*', default=list(MASKS), choices=MASKS)
+    parser.add_argument('--indices', nargs='*', default=[], choices=INDICES,
+                        help='index rasters to write as well as the masks')
+    parser.add_argument('--mask-format', choices=['tif', 'npz'], default='tif',
+                        help='uint8 TIFF masks, or bit-packed .npz archives (8 pixels per byte)')
+    parser.add_argument('--tile', type=int, default=None,
+                        help='process each scene in tiles of this size to bound memory (masks only)')
+    parser.add_argument('--histograms', metavar='PATH', default=None,
+                        help='also bin every index over all the images and save the histograms here')
+    parser.add_argument('--histogram-indices', nargs='*', default=list(HISTOGRAM_BINS), choices=list(HISTOGRAM_BINS),
+                        help='indices binned with --histograms')
+    parser.add_argument('--cleanup', choices=CLEANUPS, default='morphology',
+                        help='open and close the CCCI mask (default), filter the connected components of '
+                             'every mask, or leave the masks as thresholded')
+    parser.add_argument('--min-area', type=int, default=MIN_COMPONENT_AREA,
+                        help='--cleanup components: drop components of fewer pixels')
+    parser.add_argument('--min-elongation', type=float, default=MIN_ELONGATION,
+                        help='--cleanup components: drop components less elongated (e.g. 3 for channels only)')
+    parser.add_argument('--max-hole-area', type=int, default=MAX_HOLE_AREA,
+                        help='--cleanup components: fill holes of up to this many pixels')
+    parser.add_argument('--resolution', type=_resolution, default='native', metavar='|'.join(RESOLUTIONS),
+                        help='grid the indices and masks are computed on (default: native)')
+    parser.add_argument('--upsample-masks', action='store_true',
+                        help='write every mask on the RGB grid, upsampled by nearest neighbour')
+    parser.add_argument('--disk-cache', metavar='DIR', default=None,
+                        help='keep index rasters and resampled bands here, so reruns only redo what changed')
+    parser.add_argument('--quicklook', action='store_true',
+                        help='also write a PNG of the RGB image, masks and histograms for each image')
+    parser.add_argument('--precision', choices=list(PRECISIONS), default='float64',
+                        help='dtype the resampled bands are computed and kept in (default: float64 resize, '
+                             'float32 bands)')
+    parser.add_argument('--quantize', choices=QUANTIZE_DTYPES, default=None,
+                        help='keep and write the index rasters as int16 or uint8 codes, thresholded as they are')
+    parser.add_argument('--mosaic', action='store_true',
+                        help='compute each scene with a halo from its neighbours in the grid, so masks agree '
+                             'across tile borders')
+    parser.add_argument('--mosaic-masks', action='store_true',
+                        help='also paste the masks of each grid square into one {grid}_{mask}_mosaic.tif')
+    parser.add_argument('--shard', type=_shard, default=None, metavar='I/N',
+                        help='process only shard I of N (0 .. N-1) of the images, with a checkpoint to resume from')
+    parser.add_argument('--checkpoint', metavar='PATH', default=None,
+                        help='record finished images here and skip them on a rerun '
+                             '(default with --shard: OUT/checkpoint_IofN.json)')
+    parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                        help='with a checkpoint, give up on an image after this many failed runs')
+    parser.add_argument('--profile', metavar='PATH', default=os.environ.get(profiling.ENV_VAR),
+                        help='record per-stage timings here as JSON lines, with a Chrome trace next to it '
+                             '(default: ${})'.format(profiling.ENV_VAR))
+    args = parser.parse_args(argv)
+
+    if args.tile and args.indices:
+        parser.error('--tile only produces masks, drop --indices')
+    if args.tile and args.resolution != 'native':
+        parser.error('--tile only works at the native resolution')
+    if args.tile and args.cleanup == 'components':
+        parser.error('--cleanup components needs whole masks, drop --tile')
+    if args.tile and (args.precision != 'float64' or args.quantize):
+        parser.error('--tile always computes in full precision, drop --precision and --quantize')
+    if args.mosaic and (args.tile or args.histograms or args.disk_cache):
+        parser.error('--mosaic works on whole scenes, drop --tile, --histograms and --disk-cache')
+    if args.mosaic and args.resolution not in ('native', 'ms'):
+        parser.error('--mosaic only works at the native or ms resolution')
+    if args.mosaic_masks and args.mask_format != 'tif':
+        parser.error('--mosaic-masks pastes TIFF masks, drop --mask-format npz')
+
+    if args.ids:
+        image_ids = args.ids
+    elif args.test_set:
+        image_ids = WATERWAY_TEST
+    else:
+        image_ids = select_image_ids(args.csv, None if args.all else args.class_type,
+                                     load_catalog(args.catalog) if args.catalog else None)
+
+    checkpoint = None
+    if args.shard or args.checkpoint:
+        index, count = args.shard or (0, 1)
+        # a grid square stays in one shard, so its mosaic can be pasted there
+        image_ids = shard_ids(image_ids, index, count, key=_grid if args.mosaic_masks else None)
+        checkpoint = Checkpoint(args.checkpoint or checkpoint_path(args.out, index, count))
+        all_ids = image_ids
+        image_ids = checkpoint.pending(all_ids, args.max_attempts)
+        print('shard {}/{}: {} images, {} done, {} given up, {} to run'.format(
+            index, count, len(all_ids), len(checkpoint.done(all_ids)),
+            len(checkpoint.exhausted(all_ids, args.max_attempts)), len(image_ids)))
+
+    if args.profile:
+        # a fresh file (typically under --out, which may not exist yet), and
+        # the worker processes pick the path up from the environment
+        os.makedirs(os.path.dirname(os.path.abspath(args.profile)), exist_ok=True)
+        open(args.profile, 'w').close()
+        os.environ[profiling.ENV_VAR] = args.profile
+        profiling.enable(args.profile)
+
+    start = time.perf_counter()
+    results = run_batch(image_ids, args.out, workers=args.workers, masks=args.masks, indices=args.indices,
+                        tile=args.tile, data_dir=args.data_dir, mask_format=args.mask_format,
+                        histograms=args.histogram_indices if args.histograms else (),
+                        quicklook=args.quicklook, resolution=args.resolution,
+                        upsample_masks=args.upsample_masks, disk_cache=args.disk_cache, catalog=args.catalog,
+                        cleanup=args.cleanup, min_area=args.min_area, min_elongation=args.min_elongation,
+                        max_hole_area=args.max_hole_area, mosaic=args.mosaic, precision=args.precision,
+                        quantize=args.quantize, checkpoint=checkpoint)
+    failed = [image_id for image_id, seconds, error in results if error is not None]
+    # with a checkpoint, the images finished by earlier runs count as well
+    done = (checkpoint.done(all_ids) if checkpoint is not None else
+            [image_id for image_id, seconds, error in results if error is None])
+    if args.mosaic_masks:
+        for path in write_mosaics(args.out, done, args.masks):
+            print('mosaic: {}'.format(path))
+    if args.histograms:
+        # earlier runs of a checkpoint may have been without --histograms
+        binned = [image_id for image_id in done if os.path.exists(histograms_path(args.out, image_id))]
+        if len(binned) < len(done):
+            print('{} finished images have no histograms and are left out of {}'.format(
+                len(done) - len(binned), args.histograms), file=sys.stderr)
+        save_histograms(args.histograms, merge_image_histograms(args.out, binned))
+    print('{} images, {} failed, {:.1f}s'.format(len(results), len(failed), time.perf_counter() - start))
+    if args.profile:
+        records = profiling.read_records(args.profile)
+        trace = os.path.splitext(args.profile)[0] + '.trace.json'
+        profiling.write_chrome_trace(trace, records)
+        print(profiling.summary(records))
+        print('profile: {}, trace: {}'.format(args.profile, trace))
+    if failed:
+        print('failed: ' + ' '.join(failed), file=sys.stderr)
+    given_up = checkpoint.exhausted(all_ids, args.max_attempts) if checkpoint is not None else []
+    if given_up:
+        print('given up after {} attempts: {}'.format(args.max_attempts, ' '.join(given_up)), file=sys.stderr)
+    return 1 if failed or given_up else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
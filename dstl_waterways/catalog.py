@@ -0,0 +1,196 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+from dstl_waterways.atomic import atomic_write
+from dstl_waterways.scene import PRODUCTS
+
+# Dataset catalog: one scan of train_wkt_v4.csv and of the three_band/ and
+# sixteen_band/ directories, kept as a small JSON index of every image id,
+# the classes it has polygons for, and for each product file its path, shape,
+# dtype and where its pixel data starts. Queries are dictionary lookups, and a
+# Scene given the catalog maps a product straight from the stored offset
+# instead of having tifffile parse the TIFF header and its thousands of strip
+# offsets first.
+#
+#   python catalog.py --build --csv train_wkt_v4.csv --data-dir . --out catalog.json
+#   python catalog.py --out catalog.json --class-type 7
+#   catalog = load_catalog('catalog.json'); catalog.image_ids(class_type=7, grid='6080')
+#
+# Offsets are only stored for uncompressed products whose data is one
+# contiguous block, which is how the DSTL files are written; anything else,
+# and any file whose size or mtime changed since the scan, is opened through
+# tifffile as before.
+
+DEFAULT_PATH = 'catalog.json'
+VERSION = 1
+EMPTY_WKT = 'MULTIPOLYGON EMPTY'
+
+
+def _file_patterns():
+    # {directory: [(regex of the file names, product)]}, the regex capturing the image id
+    patterns = {}
+    for product, (directory, pattern) in PRODUCTS.items():
+        prefix, suffix = pattern.split('{}')
+        patterns.setdefault(directory, []).append(
+            (re.compile('^{}(.+){}$'.format(re.escape(prefix), re.escape(suffix))), product))
+    return patterns
+
+
+def scan_classes(csv_path):
+    # {image id: [class types with a non-empty polygon]}, reading the csv
+    # row by row rather than building a frame of all the WKT
+    csv.field_size_limit(sys.maxsize)
+    classes = {}
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        image_col, class_col, wkt_col = (header.index(name) for name in ('ImageId', 'ClassType', 'MultipolygonWKT'))
+        for row in reader:
+            image_classes = classes.setdefault(row[image_col], [])
+            if row[wkt_col] != EMPTY_WKT:
+                image_classes.append(int(row[class_col]))
+    return {image_id: sorted(class_types) for image_id, class_types in classes.items()}
+
+
+def describe_tiff(path):
+    # shape, dtype and layout of a TIFF's first series, plus the file's size
+    # and mtime to tell later whether the description still holds
+    import tifffile as tiff
+    with tiff.TiffFile(path) as tif:
+        series = tif.series[0]
+        page = tif.pages[0]
+        entry = {'shape': list(series.shape),
+                 'dtype': np.dtype(series.dtype).newbyteorder(tif.byteorder).str,
+                 'compression': int(page.compression),
+                 'offset': series.dataoffset}
+    st = os.stat(path)
+    entry['size'] = st.st_size
+    entry['mtime_ns'] = st.st_mtime_ns
+    return entry
+
+
+def scan_products(data_dir='.'):
+    # {image id: {product: entry}} of every product file under data_dir, with
+    # entry['path'] relative to data_dir
+    images = {}
+    for directory, patterns in _file_patterns().items():
+        root = os.path.join(data_dir, directory)
+        if not os.path.isdir(root):
+            continue
+        for name in sorted(os.listdir(root)):
+            for pattern, product in patterns:
+                match = pattern.match(name)
+                if match:
+                    entry = describe_tiff(os.path.join(root, name))
+                    entry['path'] = os.path.join(directory, name)
+                    images.setdefault(match.group(1), {})[product] = entry
+                    break
+    return images
+
+
+def _grid(image_id):
+    # '6080_4_3' -> '6080'
+    return image_id.split('_', 1)[0]
+
+
+class Catalog(object):
+
+    def __init__(self, images):
+        # images: {image id: {'classes': [class types], 'products': {product: entry}}}
+        self.images = images
+
+    def image_ids(self, class_type=None, grid=None):
+        # sorted ids, optionally only those with polygons of class_type and /
+        # or in the given grid square (the first part of the id, e.g. '6080')
+        return sorted(image_id for image_id, image in self.images.items()
+                      if (class_type is None or class_type in image['classes']) and
+                      (grid is None or _grid(image_id) == str(grid)))
+
+    def classes(self, image_id):
+        return self.images[image_id]['classes']
+
+    def entry(self, image_id, product):
+        # the stored description of a product file, or None
+        return self.images.get(image_id, {}).get('products', {}).get(product)
+
+    def open(self, image_id, product, path):
+        # the product at path memory-mapped from the stored offset, or None if
+        # the catalog cannot vouch for the file as it is now
+        entry = self.entry(image_id, product)
+        if entry is None or entry['offset'] is None or entry['compression'] != 1:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size != entry['size'] or st.st_mtime_ns != entry['mtime_ns']:
+            return None
+        return np.memmap(path, dtype=np.dtype(entry['dtype']), mode='r', offset=entry['offset'],
+                         shape=tuple(entry['shape']))
+
+    def save(self, path):
+        # replaced atomically, so readers never see half a file
+        with atomic_write(path, 'w') as f:
+            json.dump({'version': VERSION, 'images': self.images}, f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != VERSION:
+            raise ValueError('{} is a version {} catalog, rebuild it'.format(path, data.get('version')))
+        return cls(data['images'])
+
+
+def build_catalog(csv_path='train_wkt_v4.csv', data_dir='.'):
+    # a Catalog of every image in the csv or under data_dir; either may be
+    # missing (csv_path=None, or no image directories)
+    classes = scan_classes(csv_path) if csv_path else {}
+    products = scan_products(data_dir)
+    return Catalog({image_id: {'classes': classes.get(image_id, []), 'products': products.get(image_id, {})}
+                    for image_id in sorted(set(classes) | set(products))})
+
+
+_loaded = {}
+
+
+def load_catalog(path):
+    # Catalog.load, once per process for as long as the file is unchanged
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    if key not in _loaded:
+        _loaded.clear()
+        _loaded[key] = Catalog.load(path)
+    return _loaded[key]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or query the dataset catalog.')
+    parser.add_argument('--out', default=DEFAULT_PATH, help='catalog file')
+    parser.add_argument('--build', action='store_true', help='scan --csv and --data-dir into --out')
+    parser.add_argument('--csv', default='train_wkt_v4.csv', help='training polygons (skipped if missing)')
+    parser.add_argument('--data-dir', default='.', help='directory holding three_band/ and sixteen_band/')
+    parser.add_argument('--class-type', type=int, default=None, help='list the ids with polygons of this class')
+    parser.add_argument('--grid', default=None, help='list the ids in this grid square, e.g. 6080')
+    args = parser.parse_args(argv)
+
+    if args.build:
+        catalog = build_catalog(args.csv if os.path.exists(args.csv) else None, args.data_dir)
+        catalog.save(args.out)
+        mapped = sum(entry['offset'] is not None for image in catalog.images.values()
+                     for entry in image['products'].values())
+        print('{}: {} images, {} products with stored offsets'.format(args.out, len(catalog.images), mapped))
+    else:
+        catalog = load_catalog(args.out)
+    if args.class_type is not None or args.grid is not None:
+        print('\n'.join(catalog.image_ids(args.class_type, args.grid)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
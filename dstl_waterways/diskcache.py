@@ -0,0 +1,111 @@
+import hashlib
+import os
+
+import numpy as np
+
+from dstl_waterways.atomic import atomic_write
+
+# Persistent cache of computed rasters (index rasters, resampled bands) as
+# .npy files, memory-mapped on load. Entries are content addressed: the file
+# name is a hash of everything the raster depends on, i.e. the identity of
+# the source files (path, size, mtime; see Scene.identity), the function and
+# its parameters, so a changed TIFF or parameter simply misses, and nothing
+# is ever invalidated.
+# Least recently used files are deleted once the cache exceeds max_bytes.
+#
+# Files are written atomically (see atomic.py), so any number of processes
+# can share one cache directory.
+
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+# bump when a change to the index code changes its results
+VERSION = 1
+
+
+class DiskCache(object):
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, *parts):
+        # hash of parts, which must have a stable repr (str, numbers, tuples, enums)
+        return hashlib.sha1(repr((VERSION,) + parts).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key + '.npy')
+
+    def get(self, key):
+        # the raster memory-mapped read-only, or None
+        path = self.path(key)
+        try:
+            out = np.load(path, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            # the mtime is the last use, for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return out
+
+    def put(self, key, array):
+        with atomic_write(self.path(key)) as f:
+            np.save(f, np.asarray(array))
+        self.evict()
+
+    def get_or_compute(self, parts, compute):
+        # the cached raster for parts, computing and storing it on a miss
+        key = self.key(*parts)
+        out = self.get(key)
+        if out is None:
+            out = compute()
+            self.put(key, out)
+        return out
+
+    def _entries(self):
+        # [(last use, size, path)] of every cached file
+        entries = []
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith('.npy'):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        return entries
+
+    def nbytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        # deletes least recently used files until the cache fits max_bytes
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already evicted by another process
+                pass
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,309 @@
+import argparse
+import os
+import re
+import sys
+
+import numpy as np
+
+from dstl_waterways.bitmask import BitMask
+
+# Evaluation against the competition ground truth:
+#   - rasterize the MultipolygonWKT of train_wkt_v4.csv onto any scene grid
+#     (cached in memory and, optionally, as bit-packed .npz files)
+#   - vectorize predicted masks back to MULTIPOLYGON WKT in the same
+#     coordinate system, ready for a submission file
+#   - Jaccard, precision and recall per image and over a whole run
+#
+#   python evaluate.py --pred-dir masks --mask NDWI --class-type 7
+#
+# Competition coordinates run from 0 to Xmax across and 0 to Ymin (negative)
+# down; on a grid of H x W pixels x maps to x * W' / Xmax with W' = W * W / (W + 1),
+# and likewise y to y * H' / Ymin (see grid_sizes.csv).
+
+EMPTY_WKT = 'MULTIPOLYGON EMPTY'
+
+
+def _grid_scale(shape, xmax, ymin):
+    # pixels per competition unit, (down, across)
+    h, w = shape
+    return h * h / (h + 1.0) / ymin, w * w / (w + 1.0) / xmax
+
+
+def parse_multipolygon(wkt):
+    # [[ring, ...] per polygon], exterior ring first, each ring an (n, 2) array of (x, y)
+    polygons = []
+    if wkt.strip().upper().endswith('EMPTY'):
+        return polygons
+    depth = 0
+    start = 0
+    for match in re.finditer(r'[()]', wkt):
+        if match.group() == '(':
+            depth += 1
+            if depth == 2:
+                polygons.append([])
+            elif depth == 3:
+                start = match.end()
+        else:
+            if depth == 3:
+                values = wkt[start:match.start()].replace(',', ' ').split()
+                polygons[-1].append(np.array(values, dtype=np.float64).reshape(-1, 2))
+            depth -= 1
+    return polygons
+
+
+def rasterize_wkt(wkt, shape, xmax, ymin):
+    # bool mask of the pixels whose centres fall inside the multipolygon, by
+    # even-odd scanline fill over every ring edge at once: a pixel is inside
+    # when an odd number of edges cross its row to the left of its centre
+    rows, cols = shape
+    sy, sx = _grid_scale(shape, xmax, ymin)
+    edges = [np.concatenate([ring, ring[:1]]) * (sx, sy)
+             for rings in parse_multipolygon(wkt) for ring in rings]
+    if not edges:
+        return np.zeros(shape, dtype=bool)
+    edges = np.concatenate([np.hstack([ring[:-1], ring[1:]]) for ring in edges])
+    x0, y0, x1, y1 = edges.T
+
+    # rows whose centre r + 0.5 lies in [min(y0, y1), max(y0, y1)) of each edge
+    first = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, rows).astype(np.int64)
+    last = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, rows).astype(np.int64)
+    spans = last - first
+    edge = np.repeat(np.arange(len(spans)), spans)
+    r = np.arange(len(edge)) - np.repeat(np.cumsum(spans) - spans, spans) + first[edge]
+
+    # where each crossing meets its row, and the first pixel centre right of it
+    y = r + 0.5
+    x = x0[edge] + (y - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+    c = np.clip(np.floor(x - 0.5).astype(np.int64) + 1, 0, cols)
+
+    toggles = np.zeros((rows, cols + 1), dtype=np.uint8)
+    keys, counts = np.unique(r * (cols + 1) + c, return_counts=True)
+    toggles.flat[keys] = counts & 1
+    return (np.cumsum(toggles, axis=1, dtype=np.uint8)[:, :cols] & 1).astype(bool)
+
+
+# boundary tracing: every edge between a mask pixel and a non-mask pixel is
+# a unit step between pixel corners, walked so the mask is on the right
+# (clockwise around a single pixel, with rows growing downwards)
+_STEPS = np.array([[0, 1], [1, 0], [0, -1], [-1, 0]])     # right, down, left, up
+
+
+def _boundary_edges(mask):
+    # start corner (row, col), direction and the mask pixel of every edge
+    padded = np.pad(mask, 1)
+    core = padded[1:-1, 1:-1]
+    starts, dirs, pixels = [], [], []
+    # (neighbour, start corner offset) for the top, right, bottom and left edges
+    sides = [(padded[:-2, 1:-1], (0, 0)), (padded[1:-1, 2:], (0, 1)),
+             (padded[2:, 1:-1], (1, 1)), (padded[1:-1, :-2], (1, 0))]
+    for direction, (neighbour, offset) in enumerate(sides):
+        r, c = np.nonzero(core & ~neighbour)
+        starts.append(np.stack([r + offset[0], c + offset[1]], axis=1))
+        dirs.append(np.full(r.shape, direction))
+        pixels.append(np.stack([r, c], axis=1))
+    return np.concatenate(starts), np.concatenate(dirs), np.concatenate(pixels)
+
+
+def trace_rings(mask):
+    # [(corners, pixel)]: each boundary ring as an (n, 2) array of (row, col)
+    # pixel corners, collinear corners dropped, and one mask pixel it bounds
+    starts, dirs, pixels = _boundary_edges(np.asarray(mask, dtype=bool))
+    if not len(dirs):
+        return []
+    width = mask.shape[1] + 1
+    ends = starts + _STEPS[dirs]
+    start_keys = starts[:, 0] * width + starts[:, 1]
+    end_keys = ends[:, 0] * width + ends[:, 1]
+
+    # link each edge to the edge leaving its end corner; where two leave (mask
+    # pixels touching only diagonally) take the right turn, so such pixels
+    # end up in separate rings, as in 4-connected labelling
+    order = np.argsort(start_keys, kind='stable')
+    sorted_keys = start_keys[order]
+    first = np.searchsorted(sorted_keys, end_keys, side='left')
+    count = np.searchsorted(sorted_keys, end_keys, side='right') - first
+    nxt = order[first]
+    two = np.nonzero(count == 2)[0]
+    second = order[first[two] + 1]
+    use_second = dirs[second] == (dirs[two] + 1) % 4
+    nxt[two[use_second]] = second[use_second]
+
+    rings = []
+    nxt = nxt.tolist()
+    seen = bytearray(len(nxt))
+    for edge in range(len(nxt)):
+        if seen[edge]:
+            continue
+        ring = []
+        while not seen[edge]:
+            seen[edge] = 1
+            ring.append(edge)
+            edge = nxt[edge]
+        ring = np.array(ring)
+        ring_dirs = dirs[ring]
+        corner = np.empty(len(ring), dtype=bool)
+        corner[0] = ring_dirs[0] != ring_dirs[-1]
+        corner[1:] = ring_dirs[1:] != ring_dirs[:-1]
+        rings.append((starts[ring[corner]], pixels[ring[0]]))
+    return rings
+
+
+def _signed_area(corners):
+    # positive for rings around mask pixels, negative for holes
+    y, x = corners[:, 0].astype(np.float64), corners[:, 1].astype(np.float64)
+    return (np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]) + x[-1] * y[0] - x[0] * y[-1]) / 2.0
+
+
+def mask_to_polygons(mask, min_pixels=0):
+    # [[exterior, hole, ...] per 4-connected component], rings as (row, col)
+    # corners; components smaller than min_pixels are left out
+    from scipy import ndimage
+    mask = np.asarray(mask, dtype=bool)
+    labels, n = ndimage.label(mask)
+    sizes = np.bincount(labels.ravel(), minlength=n + 1)
+    exteriors = {}
+    holes = {}
+    for corners, pixel in trace_rings(mask):
+        label = labels[pixel[0], pixel[1]]
+        if sizes[label] < min_pixels:
+            continue
+        if _signed_area(corners) > 0:
+            exteriors[label] = corners
+        else:
+            holes.setdefault(label, []).append(corners)
+    return [[exteriors[label]] + holes.get(label, []) for label in sorted(exteriors)]
+
+
+def mask_to_wkt(mask, xmax, ymin, min_pixels=0, precision=9):
+    # the mask as MULTIPOLYGON WKT in competition coordinates
+    polygons = mask_to_polygons(mask, min_pixels)
+    if not polygons:
+        return EMPTY_WKT
+    sy, sx = _grid_scale(np.shape(mask), xmax, ymin)
+    point = '%.{0}g %.{0}g'.format(precision)
+
+    def ring_wkt(corners):
+        # closed ring of (x, y); + 0.0 turns -0.0 into 0
+        xy = np.empty((len(corners) + 1, 2))
+        xy[:-1, 0] = corners[:, 1] / sx + 0.0
+        xy[:-1, 1] = corners[:, 0] / sy + 0.0
+        xy[-1] = xy[0]
+        return '(' + ', '.join([point] * len(xy)) % tuple(xy.ravel().tolist()) + ')'
+
+    return 'MULTIPOLYGON (' + ', '.join(
+        '(' + ', '.join(ring_wkt(ring) for ring in rings) + ')' for rings in polygons) + ')'
+
+
+class GroundTruth(object):
+    # the training polygons and grid sizes, read once, with rasterized masks
+    # cached per (image, class, grid shape)
+
+    def __init__(self, csv_path='train_wkt_v4.csv', grid_sizes_path='grid_sizes.csv', cache_dir=None):
+        import pandas as pd
+        polygons = pd.read_csv(csv_path)
+        self.wkt = {(row.ImageId, row.ClassType): row.MultipolygonWKT for row in polygons.itertuples()}
+        grid_sizes = pd.read_csv(grid_sizes_path, index_col=0)
+        self.grid_sizes = {image_id: (row.Xmax, row.Ymin) for image_id, row in grid_sizes.iterrows()}
+        self.cache_dir = cache_dir
+        self._masks = {}
+
+    def image_ids(self, class_type):
+        # images with a non-empty polygon of the class
+        return sorted(image_id for (image_id, ct), wkt in self.wkt.items()
+                      if ct == class_type and wkt != EMPTY_WKT)
+
+    def mask(self, image_id, class_type, shape):
+        # BitMask of the class on a grid of the given shape
+        key = (image_id, class_type, tuple(shape))
+        if key in self._masks:
+            return self._masks[key]
+        path = None
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, '{}_{}_{}x{}.npz'.format(image_id, class_type, *shape))
+            if os.path.exists(path):
+                self._masks[key] = BitMask.load(path)
+                return self._masks[key]
+        xmax, ymin = self.grid_sizes[image_id]
+        mask = BitMask.from_bool(rasterize_wkt(self.wkt.get((image_id, class_type), EMPTY_WKT),
+                                               shape, xmax, ymin))
+        if path:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            mask.save(path)
+        self._masks[key] = mask
+        return mask
+
+
+def score(pred, truth):
+    # pixel counts and scores of a predicted BitMask against the truth
+    tp = (pred & truth).area()
+    fp = pred.area() - tp
+    fn = truth.area() - tp
+    return _scores(tp, fp, fn)
+
+
+def _scores(tp, fp, fn):
+    ratio = lambda a, b: a / float(b) if b else 1.0
+    return {'tp': tp, 'fp': fp, 'fn': fn, 'jaccard': ratio(tp, tp + fp + fn),
+            'precision': ratio(tp, tp + fp), 'recall': ratio(tp, tp + fn)}
+
+
+def score_images(truth, predictions, class_type=7):
+    # predictions: iterable of (image_id, bool mask or BitMask)
+    # returns ({image_id: scores}, scores over all pixels of all images)
+    per_image = {}
+    totals = [0, 0, 0]
+    for image_id, pred in predictions:
+        if not isinstance(pred, BitMask):
+            pred = BitMask.from_bool(pred)
+        per_image[image_id] = score(pred, truth.mask(image_id, class_type, pred.shape))
+        for i, key in enumerate(('tp', 'fp', 'fn')):
+            totals[i] += per_image[image_id][key]
+    return per_image, _scores(*totals)
+
+
+def load_mask(pred_dir, image_id, mask):
+    # a mask written by batch.py, as .npz or .tif
+    path = os.path.join(pred_dir, '{}_{}_mask'.format(image_id, mask))
+    if os.path.exists(path + '.npz'):
+        return BitMask.load(path + '.npz')
+    import tifffile as tiff
+    return BitMask.from_bool(tiff.imread(path + '.tif'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score predicted masks against the training polygons.')
+    parser.add_argument('--pred-dir', required=True, help='directory of masks written by batch.py')
+    parser.add_argument('--mask', default='CCCI_NIR2', help='which mask to score')
+    parser.add_argument('--class-type', type=int, default=7)
+    parser.add_argument('--ids', nargs='+', help='images to score (default: all with the class)')
+    parser.add_argument('--csv', default='train_wkt_v4.csv')
+    parser.add_argument('--grid-sizes', default='grid_sizes.csv')
+    parser.add_argument('--cache-dir', default=None, help='keep rasterized ground truth here')
+    parser.add_argument('--wkt-out', default=None, help='also write the masks as a submission-style CSV')
+    parser.add_argument('--min-pixels', type=int, default=0, help='drop smaller polygons from --wkt-out')
+    args = parser.parse_args(argv)
+
+    truth = GroundTruth(args.csv, args.grid_sizes, args.cache_dir)
+    image_ids = args.ids or truth.image_ids(args.class_type)
+    predictions = [(image_id, load_mask(args.pred_dir, image_id, args.mask)) for image_id in image_ids]
+
+    per_image, total = score_images(truth, predictions, args.class_type)
+    print('{:<12} {:>8} {:>9} {:>7}'.format('ImageId', 'jaccard', 'precision', 'recall'))
+    for image_id, s in per_image.items():
+        print('{:<12} {:>8.4f} {:>9.4f} {:>7.4f}'.format(image_id, s['jaccard'], s['precision'], s['recall']))
+    print('{:<12} {:>8.4f} {:>9.4f} {:>7.4f}'.format('all', total['jaccard'], total['precision'], total['recall']))
+
+    if args.wkt_out:
+        import csv
+        with open(args.wkt_out, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['ImageId', 'ClassType', 'MultipolygonWKT'])
+            for image_id, pred in predictions:
+                xmax, ymin = truth.grid_sizes[image_id]
+                writer.writerow([image_id, args.class_type,
+                                 mask_to_wkt(pred.to_bool(), xmax, ymin, args.min_pixels)])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
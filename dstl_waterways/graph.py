@@ -0,0 +1,66 @@
+# Lazy dependency graph: every output is a node naming the nodes and the
+# parameters it depends on. Evaluating a set of outputs runs only the nodes
+# those outputs need, each once, so shared intermediates are computed once
+# and unrequested outputs cost nothing.
+
+from dstl_waterways import profiling
+
+
+class Node(object):
+
+    def __init__(self, name, func, deps=(), params=None):
+        # func is called as func(*values of deps, **{arg: value of param key})
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = dict(params or {})
+
+
+class Graph(object):
+
+    def __init__(self, nodes=(), defaults=None):
+        # defaults: parameter values used when evaluate() is not given one
+        self.nodes = {}
+        self.defaults = dict(defaults or {})
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node.name in self.nodes:
+            raise ValueError('duplicate node {}'.format(node.name))
+        self.nodes[node.name] = node
+
+    def subgraph(self, outputs, inputs=()):
+        # names of the nodes needed for outputs, dependencies first;
+        # names in inputs are supplied by the caller and not evaluated
+        order = []
+        state = {}
+
+        def visit(name, path):
+            if name in inputs or state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError('dependency cycle: {}'.format(' -> '.join(path + [name])))
+            if name not in self.nodes:
+                raise ValueError('unknown node or missing input {}'.format(name))
+            state[name] = 'visiting'
+            for dep in self.nodes[name].deps:
+                visit(dep, path + [name])
+            state[name] = 'done'
+            order.append(name)
+
+        for name in outputs:
+            visit(name, [])
+        return order
+
+    def evaluate(self, outputs, inputs, params=None):
+        # {name: value} for every name in outputs
+        values = dict(inputs)
+        settings = dict(self.defaults)
+        settings.update(params or {})
+        for name in self.subgraph(outputs, values):
+            node = self.nodes[name]
+            kwargs = {arg: settings[key] for arg, key in node.params.items()}
+            with profiling.stage(name):
+                values[name] = node.func(*[values[dep] for dep in node.deps], **kwargs)
+        return {name: values[name] for name in outputs}
@@ -0,0 +1,107 @@
+import numpy as np
+
+# Fixed-bin histograms that can be updated tile by tile, added together across
+# images and worker processes, and saved to .npz. With a fixed range and bin
+# count the counts of np.histogram simply add up, so binning the tiles of a
+# scene, or the scenes of a dataset, one at a time gives exactly the counts of
+# one np.histogram over all of them.
+#
+#   hists = new_histograms(['NDWI', 'CCCI_NIR2'])
+#   for tile in tiles: hists['NDWI'].update(tile_ndwi)
+#   save_histograms('ndwi.npz', hists)
+#   merge_histograms(hists, load_histograms('other_worker.npz'))
+
+# index -> (range, bins); the panels of waterways_with_histograms.py and the
+# dataset-wide distributions. NDWI and NDVI are normalised differences of
+# non-negative bands, so always within [-1, 1].
+HISTOGRAM_BINS = {
+    'CCCI_NIR2': ((-2, 2), 50),
+    'NDWI': ((-1, 1), 50),
+    'NDVI': ((-1, 1), 50),
+    'EVI': ((-2, 2), 50),
+    'SAVI': ((-1.5, 1.5), 50),
+    'FAUX_CCCI': ((-.4, .4), 50),
+    'CCCI_SWIR': ((.4, 1.2), 50),
+}
+
+
+class Histogram(object):
+
+    def __init__(self, value_range, bins=50, counts=None, total=0):
+        self.range = (float(value_range[0]), float(value_range[1]))
+        self.bins = int(bins)
+        self.counts = np.zeros(self.bins, dtype=np.int64) if counts is None else counts
+        # every value seen, including those outside the range
+        self.total = int(total)
+
+    @property
+    def edges(self):
+        return np.linspace(self.range[0], self.range[1], self.bins + 1)
+
+    @property
+    def outside(self):
+        # values that fell outside the range
+        return self.total - int(self.counts.sum())
+
+    def update(self, values):
+        counts, _ = np.histogram(values, range=self.range, bins=self.bins)
+        self.counts += counts
+        self.total += np.size(values)
+        return self
+
+    def merge(self, other):
+        if other.range != self.range or other.bins != self.bins:
+            raise ValueError('cannot merge histograms with range {} / {} bins and range {} / {} bins'.format(
+                self.range, self.bins, other.range, other.bins))
+        self.counts += other.counts
+        self.total += other.total
+        return self
+
+    def histogram(self):
+        # (hist, bin_edges), as np.histogram returns them
+        return self.counts, self.edges
+
+    def save(self, path):
+        save_histograms(path, {'histogram': self})
+
+    @classmethod
+    def load(cls, path):
+        return load_histograms(path)['histogram']
+
+
+def new_histograms(names, bins=HISTOGRAM_BINS):
+    # {index name: empty Histogram} with the bins of each index
+    return {name: Histogram(*bins[name]) for name in names}
+
+
+def merge_histograms(into, other):
+    # adds the histograms of other into those of into with the same name;
+    # names only in other are copied over
+    for name, hist in other.items():
+        if name in into:
+            into[name].merge(hist)
+        else:
+            into[name] = Histogram(hist.range, hist.bins, hist.counts.copy(), hist.total)
+    return into
+
+
+def save_histograms(path, hists):
+    # one .npz holding {name: Histogram}
+    arrays = {}
+    for name, hist in hists.items():
+        arrays[name + '/counts'] = hist.counts
+        arrays[name + '/range'] = np.array(hist.range)
+        arrays[name + '/total'] = np.array(hist.total)
+    np.savez_compressed(path, **arrays)
+
+
+def load_histograms(path):
+    hists = {}
+    with np.load(path) as f:
+        for key in f.files:
+            name, field = key.rsplit('/', 1)
+            if field == 'counts':
+                counts = f[key]
+                hists[name] = Histogram(tuple(f[name + '/range']), len(counts), counts,
+                                        int(f[name + '/total']))
+    return hists
@@ -0,0 +1,339 @@
+import numpy as np
+
+from dstl_waterways.bands import WV3ms, WV3swir
+from dstl_waterways.resample import ResampleCache, block_mean, resize_band
+
+# Fused index engine: every band is cast to float32 once and every sum or
+# difference shared between indices (NIR1 +/- R, NIR2 +/- R, NIR2 +/- RE ...)
+# is computed once per scene, instead of once per index function.
+#
+# All arithmetic and the inf / nan cleanup run in place. Given a Workspace,
+# the bands, shared terms and scratch arrays live in its buffers, which are
+# reused by the next scene or tile instead of being allocated again; the
+# index functions also take an out= array to write the index into.
+
+INDICES = ('NDWI', 'NDVI', 'EVI', 'SAVI', 'CCCI_NIR2', 'CCCI_SWIR', 'FAUX_CCCI')
+
+# extra data each index needs on top of the M bands; NEEDS_RGB indices are
+# computed on the RGB grid, all others on the M grid
+NEEDS_SWIR = ('CCCI_SWIR',)
+NEEDS_RGB = ('FAUX_CCCI',)
+
+# Grid the indices are computed on:
+#   'native' - each index on the grid of its own bands: FAUX_CCCI on the RGB
+#              grid with RE and NIR2 upsampled to it, all others on the M grid
+#   'ms'     - every index on the M grid; FAUX_CCCI block-averages the RGB red
+#              band down to it instead of upsampling the M bands 16x
+#   'rgb'    - every index on the RGB grid, M and SWIR bands upsampled to it
+#   'rgb/N'  - the RGB grid downsampled N times, e.g. 'rgb/2'
+# Masks computed on a coarser grid can be brought to the RGB grid at the end
+# with resample.upsample_nearest.
+RESOLUTIONS = ('native', 'ms', 'rgb', 'rgb/N')
+
+# Precision of the resampled bands, as (dtype the resize runs in, dtype the
+# band is kept in):
+#   'float64' - resized in double precision, kept as float32 (the default)
+#   'float32' - resized in single precision, halving the resize's own memory
+#   'float16' - resized in single precision and kept in half precision,
+#               halving what the bands hold in the resample cache too
+# Index arithmetic runs in float32 whatever the bands are kept in, but
+# float16 bands a few counts apart round to the same value, making a ratio
+# term exactly 0: on a full size scene about 0.02% of the FAUX_CCCI and
+# 0.03% of the CCCI_SWIR mask pixels flip (see the README), the other masks
+# are unchanged. 'float32' changes no mask.
+PRECISIONS = {
+    'float64': (None, np.float32),
+    'float32': (np.float32, np.float32),
+    'float16': (np.float32, np.float16),
+}
+
+# The value of L varies by the amount or cover of green vegetation: in very high vegetation regions,
+# L=0; and in areas with no green vegetation, L=1. Generally, an L=0.5 works well in most situations
+# and is the default value used. When L=0, then SAVI = NDVI.
+SAVI_L = 0.5
+
+G = WV3ms.GREEN
+R = WV3ms.RED
+CB = WV3ms.COASTAL
+RE = WV3ms.REDEDGE
+NIR1 = WV3ms.NEARIR1
+NIR2 = WV3ms.NEARIR2
+
+
+def grid_shape(resolution, ms_shape, rgb_shape=None):
+    # (rows, cols) every index is computed on, None for 'native'
+    if resolution == 'native':
+        return None
+    if resolution == 'ms':
+        return tuple(ms_shape)
+    if resolution == 'rgb' or resolution.startswith('rgb/'):
+        if rgb_shape is None:
+            raise ValueError('resolution {} needs the RGB grid shape'.format(resolution))
+        factor = resolution[4:] or '1'
+        if not factor.isdigit() or int(factor) < 1:
+            raise ValueError('resolution {} is not rgb/N with a whole N >= 1'.format(resolution))
+        factor = int(factor)
+        return (-(-rgb_shape[0] // factor), -(-rgb_shape[1] // factor))
+    raise ValueError('unknown resolution {}, expected one of {}'.format(resolution, RESOLUTIONS))
+
+
+def safe_divide(a, b, out=None):
+    # a / b with +inf and nan set to 0, -inf clamped to the most negative float;
+    # out may be a or b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q = np.true_divide(a, b, out=out)
+    return np.nan_to_num(q, copy=False, posinf=0)
+
+
+class Workspace(object):
+    # float32 buffers reused across scenes and tiles. Each key keeps one flat
+    # buffer, grown when a larger array is asked for; smaller requests get a
+    # view of its start. One workspace must only serve one SceneTerms at a time.
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, key, shape, dtype=np.float32):
+        size = int(np.prod(shape))
+        buf = self._buffers.get(key)
+        if buf is None or buf.size < size or buf.dtype != dtype:
+            buf = self._buffers[key] = np.empty(size, dtype=dtype)
+        return buf[:size].reshape(shape)
+
+    @property
+    def nbytes(self):
+        return sum(buf.nbytes for buf in self._buffers.values())
+
+    def clear(self):
+        self._buffers.clear()
+
+
+class SceneTerms(object):
+    # float32 bands of one scene plus the sums and differences built from them,
+    # each computed the first time it is asked for and then shared
+
+    def __init__(self, msdata, swirdata=None, rgbdata=None, resampled=None, image_id=None, cache=None,
+                 workspace=None, grid=None, disk_cache=None, source=None, precision='float64'):
+        self.msdata = msdata
+        self.swirdata = swirdata
+        self.rgbdata = rgbdata
+        # with an image_id, resampled bands go through cache, by default a
+        # ResampleCache of these terms' own, freed with them
+        self.image_id = image_id
+        self.cache = ResampleCache() if cache is None else cache
+        # bands, terms and scratch arrays are taken from the workspace if given
+        self.workspace = workspace
+        # (rows, cols) every band is brought to, see grid_shape; None for 'native'
+        self.grid = None if grid is None else tuple(grid)
+        # with a diskcache.DiskCache and source, a function giving the identity
+        # of a product's file (Scene.identity), resampled bands persist across runs
+        self.disk_cache = disk_cache
+        self.source = source
+        # resampled bands are computed and kept in the dtypes of PRECISIONS[precision]
+        if precision not in PRECISIONS:
+            raise ValueError('unknown precision {}, expected one of {}'.format(precision, tuple(PRECISIONS)))
+        self.precision = precision
+        # already resampled bands ('SWIR1', 'RE_RGB', 'NIR2_RGB') skip the resize below
+        self._memo = dict(resampled or {})
+
+    def _get(self, key, make):
+        if key not in self._memo:
+            self._memo[key] = make()
+        return self._memo[key]
+
+    def scratch(self, key, shape):
+        # an uninitialised float32 array, from the workspace if there is one
+        if self.workspace is None:
+            return np.empty(shape, dtype=np.float32)
+        return self.workspace.get(key, shape)
+
+    def result(self, shape, out=None):
+        # the array an index is written to; never a workspace buffer, since
+        # the caller keeps it after the workspace has moved on
+        return np.empty(shape, dtype=np.float32) if out is None else out
+
+    def band(self, key):
+        return self._get(key, lambda: self._make_band(key))
+
+    def _cast(self, key, data):
+        out = self.scratch(key, data.shape)
+        out[...] = data
+        return out
+
+    def _resize(self, sensor, band, data, shape, **options):
+        work_dtype, dtype = PRECISIONS[self.precision]
+
+        def resize():
+            return resize_band(self.image_id, sensor, band, data, shape, dtype=dtype, cache=self.cache,
+                               work_dtype=work_dtype, **options)
+        if self.disk_cache is None or self.source is None:
+            return resize()
+        parts = ('resize', self.source(sensor), band.value, tuple(shape), tuple(sorted(options.items())))
+        if self.precision != 'float64':
+            parts += (self.precision,)
+        return self.disk_cache.get_or_compute(parts, resize)
+
+    def _make_band(self, key):
+        ms_shape = self.msdata.shape[1:] if self.msdata is not None else None
+        grid = self.grid or ms_shape
+        if isinstance(key, WV3ms):
+            if grid == ms_shape:
+                return self._cast(key, self.msdata[key.value, :, :])
+            return self._resize('M', key, self.msdata[key.value, :, :], grid, mode='constant', preserve_range=True)
+        if key == 'SWIR1':
+            if self.swirdata is None:
+                raise ValueError('CCCI_SWIR needs the SWIR bands')
+            # SWIR (134, 133) upsampled to the M grid (838, 835)
+            return self._resize('A', WV3swir.SWIR_1, self.swirdata[WV3swir.SWIR_1.value, :, :], grid,
+                                mode='constant', preserve_range=True)
+        if self.rgbdata is None:
+            raise ValueError('FAUX_CCCI needs the RGB bands')
+        rgb_shape = (self.rgbdata.shape[0], self.rgbdata.shape[1])
+        if key == 'R_RGB':
+            if self.grid is not None and self.grid != rgb_shape:
+                return block_mean(self.rgbdata[:, :, 0], self.grid)
+            return self._cast(key, self.rgbdata[:, :, 0])
+        if key == 'RE_RGB':
+            # faux CCCI only works with preserve_range=False, i.e. values in [0, 1]
+            return self._resize('M', RE, self.msdata[RE.value, :, :], rgb_shape,
+                                mode='constant', preserve_range=False)
+        if key == 'NIR2_RGB':
+            return self._resize('M', NIR2, self.msdata[NIR2.value, :, :], rgb_shape,
+                                mode='constant', preserve_range=False)
+        raise KeyError(key)
+
+    def _binary(self, key, func, x, y):
+        a, b = self.band(x), self.band(y)
+        # float32 even when both bands are kept in float16
+        return func(a, b, out=self.scratch(key, a.shape), dtype=np.float32)
+
+    def add(self, x, y):
+        key = ('+', x, y)
+        return self._get(key, lambda: self._binary(key, np.add, x, y))
+
+    def sub(self, x, y):
+        key = ('-', x, y)
+        return self._get(key, lambda: self._binary(key, np.subtract, x, y))
+
+    def ratio(self, x, y):
+        # normalised difference (x - y) / (x + y)
+        key = ('/', x, y)
+
+        def make():
+            d = self.sub(x, y)
+            return safe_divide(d, self.add(x, y), out=self.scratch(key, d.shape))
+        return self._get(key, make)
+
+
+def _copy_out(t, term, out):
+    # an index that is a shared term as it is: hand out the term itself
+    # unless it lives in the workspace or an out array was given
+    if out is None and t.workspace is None:
+        return term
+    out = t.result(term.shape, out)
+    np.copyto(out, term)
+    return out
+
+
+def _ndwi(t, L, out=None):
+    # Normalized Difference Water Index
+    # Uses McFeeter's NDWI based on MODIS band 2 and band 4
+    # NDWI = (G - NIR1)/(G + NIR1)
+    return _copy_out(t, t.ratio(G, NIR1), out)
+
+
+def _ndvi(t, L, out=None):
+    # Normalized Difference Vegetation Index
+    # NDVI = (NIR1 - R)/(NIR1 + R )
+    return _copy_out(t, t.ratio(NIR1, R), out)
+
+
+def _evi(t, L, out=None):
+    # Enhanced Vegetation Index
+    # EVI = 2.5 * (NIR2 - R)/(NIR2 + 6.0*R - 7.5*CB + 1.0)
+    d = t.sub(NIR2, R)
+    a = np.multiply(d, 2.5, out=t.result(d.shape, out))
+    b = np.multiply(t.band(R), 6.0, out=t.scratch('EVI_b', d.shape), dtype=np.float32)
+    b += t.band(NIR2)
+    b -= np.multiply(t.band(CB), 7.5, out=t.scratch('EVI_c', d.shape), dtype=np.float32)
+    b += 1.0
+    return safe_divide(a, b, out=a)
+
+
+def _savi(t, L, out=None):
+    # Soil Adjusted Vegetation Index
+    # SAVI = (1 + L) * (NIR1 - R)/(NIR1 + R + L)
+    d = t.sub(NIR1, R)
+    a = np.multiply(d, 1 + L, out=t.result(d.shape, out))
+    b = np.add(t.add(NIR1, R), L, out=t.scratch('SAVI_b', d.shape))
+    return safe_divide(a, b, out=a)
+
+
+def _ccci_nir2(t, L, out=None):
+    # Canopy Chlorophyll Content Index
+    # uses NIR2 rather than SWIR_1
+    # CCCI = ((NIR2 - RE)/ NIR2 + RE)) / ((NIR2 - R)/(NIR2 + R))
+    e = t.ratio(NIR2, RE)
+    return safe_divide(e, t.ratio(NIR2, R), out=t.result(e.shape, out))
+
+
+def _ccci_swir(t, L, out=None):
+    # Canopy Chlorophyll Content Index
+    # uses SWIR_1
+    # CCCI = ((SWIR1 - RE)/ SWIR1 + RE)) / ((SWIR1 - R)/(SWIR1 + R))
+    e = t.ratio('SWIR1', RE)
+    return safe_divide(e, t.ratio('SWIR1', R), out=t.result(e.shape, out))
+
+
+def _faux_ccci(t, L, out=None):
+    # Canopy Chlorophyll Content Index on the RGB grid, with the RGB red band
+    # standing in for NIR2 - R and NIR2 + R: c = -R, d = R
+    # on any other grid the M bands are used as they are: the ratio does not
+    # depend on their scale, so it is the one CCCI_NIR2 already shares
+    if t.grid is None:
+        e = t.ratio('NIR2_RGB', 'RE_RGB')
+    else:
+        e = t.ratio(NIR2, RE)
+    R_rgb = t.band('R_RGB')
+    f = np.negative(R_rgb, out=t.scratch('FAUX_f', R_rgb.shape))
+    f = safe_divide(f, R_rgb, out=f)
+    return safe_divide(e, f, out=t.result(e.shape, out))
+
+
+_INDEX_FUNCTIONS = {
+    'NDWI': _ndwi,
+    'NDVI': _ndvi,
+    'EVI': _evi,
+    'SAVI': _savi,
+    'CCCI_NIR2': _ccci_nir2,
+    'CCCI_SWIR': _ccci_swir,
+    'FAUX_CCCI': _faux_ccci,
+}
+
+
+def compute_index(terms, name, L=SAVI_L, out=None):
+    # one index from a SceneTerms, sharing whatever terms already holds,
+    # written to out (a float32 array of the index's grid) if given
+    if name not in _INDEX_FUNCTIONS:
+        raise ValueError('unknown index {}, expected one of {}'.format(name, INDICES))
+    return _INDEX_FUNCTIONS[name](terms, L, out)
+
+
+def compute_indices(msdata, indices=INDICES, swirdata=None, rgbdata=None, L=SAVI_L, resampled=None,
+                    image_id=None, cache=None, workspace=None, out=None, resolution='native', precision='float64'):
+    # msdata (8, rows, cols) M bands, swirdata (8, r, c) A bands, rgbdata (rows, cols, 3)
+    # returns {index name: float32 raster} for every requested index
+    # pass image_id and a resample.ResampleCache to reuse resampled bands across calls,
+    # a Workspace to reuse the intermediate arrays and out={index name: array}
+    # to write indices into existing arrays; resolution picks the grid, see RESOLUTIONS,
+    # and precision the dtypes of the resampled bands, see PRECISIONS
+    for name in indices:
+        if name not in _INDEX_FUNCTIONS:
+            raise ValueError('unknown index {}, expected one of {}'.format(name, INDICES))
+
+    out = out or {}
+    ms_shape = msdata.shape[1:] if msdata is not None else None
+    rgb_shape = rgbdata.shape[:2] if rgbdata is not None else None
+    grid = grid_shape(resolution, ms_shape, rgb_shape)
+    terms = SceneTerms(msdata, swirdata, rgbdata, resampled, image_id, cache, workspace, grid, precision=precision)
+    return {name: compute_index(terms, name, L, out.get(name)) for name in indices}
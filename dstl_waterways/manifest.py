@@ -0,0 +1,104 @@
+import json
+import os
+
+from dstl_waterways.atomic import atomic_write
+
+# Job manifest for long and multi-node batch runs: the image list is split
+# deterministically into shards (--shard i/n, every node computing the same
+# split from the same csv or id list), and every image a shard finishes or
+# fails is recorded in that shard's checkpoint file, rewritten atomically
+# after each image. A rerun after a crash or preemption skips what is done and
+# retries what failed, up to a cap. Nodes share nothing but the filesystem the
+# outputs go to, each shard writing only its own checkpoint.
+#
+#   python batch.py --class-type 7 --out masks --shard 0/4     # on node 0
+#   python batch.py --class-type 7 --out masks --shard 0/4     # again, resumes
+#
+# An attempt is counted when the image is handed to a worker, so an image
+# whose worker (or the whole run) dies on it counts that attempt as well: it is
+# left 'running' in the checkpoint, retried by the next run like a failure and
+# given up on after the same number of attempts.
+
+VERSION = 1
+# attempts per image, over all runs, before a failing image is given up on
+MAX_ATTEMPTS = 3
+
+
+def parse_shard(text):
+    # 'i/n' -> (i, n), shards numbered 0 .. n - 1
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError('shard {!r} is not of the form i/n'.format(text))
+    if not 0 <= index < count:
+        raise ValueError('shard {!r} is not one of 0/{n} .. {m}/{n}'.format(text, n=count, m=count - 1))
+    return index, count
+
+
+def shard_ids(image_ids, index, count, key=None):
+    # the sorted image ids of shard index of count: the distinct values of key
+    # (by default the ids themselves, e.g. mosaic.tile_position(id)[0] to keep
+    # grid squares together) are sorted and dealt out in turn, so the split
+    # depends only on the set of ids
+    key = key or (lambda image_id: image_id)
+    image_ids = sorted(set(image_ids))
+    groups = sorted(set(key(image_id) for image_id in image_ids))
+    mine = set(groups[index::count])
+    return [image_id for image_id in image_ids if key(image_id) in mine]
+
+
+def checkpoint_path(out_dir, index=0, count=1):
+    return os.path.join(out_dir, 'checkpoint_{}of{}.json'.format(index, count))
+
+
+class Checkpoint(object):
+
+    def __init__(self, path):
+        # path: the checkpoint file, read if it exists
+        self.path = path
+        self.images = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get('version') != VERSION:
+                raise ValueError('{} is a version {} checkpoint'.format(path, data.get('version')))
+            self.images = data['images']
+
+    def start(self, image_id):
+        # counts an attempt at image_id before it runs, and saves at once
+        entry = self.images.setdefault(image_id, {'attempts': 0})
+        entry['attempts'] += 1
+        entry['status'] = 'running'
+        self.save()
+
+    def record(self, image_id, seconds, error=None):
+        # notes how an attempt at image_id ended, error the traceback if it
+        # failed, and saves at once; an attempt not start()ed is counted here
+        entry = self.images.setdefault(image_id, {'attempts': 0})
+        if entry.get('status') != 'running':
+            entry['attempts'] += 1
+        entry['status'] = 'done' if error is None else 'failed'
+        entry['seconds'] = round(seconds, 3)
+        # the last line of the traceback, the whole of it went to stderr
+        entry['error'] = None if error is None else error.strip().splitlines()[-1]
+        self.save()
+
+    def done(self, image_ids):
+        return [image_id for image_id in image_ids if self.images.get(image_id, {}).get('status') == 'done']
+
+    def pending(self, image_ids, max_attempts=MAX_ATTEMPTS):
+        # the ids not done yet that have attempts left
+        return [image_id for image_id in image_ids if self.images.get(image_id, {}).get('status') != 'done' and
+                self.images.get(image_id, {}).get('attempts', 0) < max_attempts]
+
+    def exhausted(self, image_ids, max_attempts=MAX_ATTEMPTS):
+        # the ids that failed (or died running) max_attempts times
+        return [image_id for image_id in image_ids
+                if self.images.get(image_id, {}).get('status') in ('failed', 'running') and
+                self.images[image_id]['attempts'] >= max_attempts]
+
+    def save(self):
+        # replaced atomically, so a crash leaves either the previous
+        # checkpoint or this one
+        with atomic_write(self.path, 'w') as f:
+            json.dump({'version': VERSION, 'images': self.images}, f, indent=1, sort_keys=True)
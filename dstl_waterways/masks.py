@@ -0,0 +1,106 @@
+import numpy as np
+
+from dstl_waterways.bitmask import BitMask
+from dstl_waterways.components import filter_components
+
+# you can look on histogram and pick your favorite threshold value
+CCCI_THRESHOLD_U = 0.5
+CCCI_THRESHOLD_L = -4
+FAUX_CCCI_THRESHOLD = 0.11
+# CCCI_SWIR_THRESHOLD = 1.03
+CCCI_SWIR_THRESHOLD = .94
+NDWI_THRESHOLD = 0.07
+NDVI_THRESHOLD = 0.07
+
+MASKS = ('CCCI_NIR2', 'NDWI', 'NDVI', 'FAUX_CCCI', 'CCCI_SWIR')
+
+# mask name -> (index, threshold) for the masks that are just index > threshold
+# note the NDVI mask thresholds the NDWI raster, as it always has in display()
+THRESHOLD_MASKS = {
+    'NDWI': ('NDWI', NDWI_THRESHOLD),
+    'NDVI': ('NDWI', NDVI_THRESHOLD),
+    'FAUX_CCCI': ('FAUX_CCCI', FAUX_CCCI_THRESHOLD),
+    'CCCI_SWIR': ('CCCI_SWIR', CCCI_SWIR_THRESHOLD),
+}
+
+# How the masks are cleaned up: 'morphology' opens and closes the CCCI mask
+# and leaves the others as thresholded, as display() always has; 'components'
+# instead drops the small (and, with MIN_ELONGATION, the compact) connected
+# components of every mask and fills its small holes, see components.py;
+# 'none' leaves every mask as thresholded
+CLEANUPS = ('morphology', 'components', 'none')
+# in pixels of the grid the mask is on
+MIN_COMPONENT_AREA = 16
+MAX_HOLE_AREA = 16
+# major / minor axis ratio below which a component is dropped, 0 to keep all
+# shapes; around 3 keeps channels and drops ponds
+MIN_ELONGATION = 0
+
+# binary_opening followed by binary_closing with the default 3x3 cross is four
+# erosions/dilations of one pixel each, so a mask pixel depends on its
+# neighbours up to 4 pixels away
+MORPHOLOGY_HALO = 4
+
+
+def ccci_bitmask(ccci, upper=CCCI_THRESHOLD_U, lower=CCCI_THRESHOLD_L):
+    # water is everything outside (lower, upper), cleaned up by opening then
+    # closing; the morphology runs on the bit-packed mask
+    inside = np.logical_and(ccci < upper, ccci > lower)
+    return (~BitMask.from_bool(inside)).opening().closing()
+
+
+def ccci_mask(ccci, upper=CCCI_THRESHOLD_U, lower=CCCI_THRESHOLD_L, cleanup='morphology',
+              min_area=MIN_COMPONENT_AREA, min_elongation=MIN_ELONGATION, max_hole_area=MAX_HOLE_AREA):
+    if cleanup == 'morphology':
+        return ccci_bitmask(ccci, upper, lower).to_bool()
+    return clean_mask(~np.logical_and(ccci < upper, ccci > lower), cleanup, min_area, min_elongation, max_hole_area)
+
+
+def threshold_mask(index, threshold, cleanup='morphology',
+                   min_area=MIN_COMPONENT_AREA, min_elongation=MIN_ELONGATION, max_hole_area=MAX_HOLE_AREA):
+    return clean_mask(index > threshold, cleanup, min_area, min_elongation, max_hole_area)
+
+
+def clean_mask(mask, cleanup='components',
+               min_area=MIN_COMPONENT_AREA, min_elongation=MIN_ELONGATION, max_hole_area=MAX_HOLE_AREA):
+    # the component filter for cleanup='components'; with 'morphology' or
+    # 'none' a thresholded mask is left as it is
+    if cleanup not in CLEANUPS:
+        raise ValueError('unknown cleanup {}, expected one of {}'.format(cleanup, CLEANUPS))
+    if cleanup != 'components':
+        return mask
+    return filter_components(mask, min_area, min_elongation, max_hole_area)
+
+
+def mask_index(name):
+    # the index raster a mask is computed from
+    if name == 'CCCI_NIR2':
+        return 'CCCI_NIR2'
+    if name in THRESHOLD_MASKS:
+        return THRESHOLD_MASKS[name][0]
+    raise ValueError('unknown mask {}, expected one of {}'.format(name, MASKS))
+
+
+def mask_indices(masks=MASKS):
+    # the index rasters needed for a set of masks, without repeats
+    needed = []
+    for name in masks:
+        index = mask_index(name)
+        if index not in needed:
+            needed.append(index)
+    return needed
+
+
+def compute_masks(indices, masks=MASKS, packed=False):
+    # indices: {index name: raster} as returned by compute_indices
+    # returns {mask name: bool raster}, or {mask name: BitMask} if packed
+    out = {}
+    for name in masks:
+        index = indices[mask_index(name)]
+        if name == 'CCCI_NIR2':
+            mask = ccci_bitmask(index)
+            out[name] = mask if packed else mask.to_bool()
+        else:
+            mask = index > THRESHOLD_MASKS[name][1]
+            out[name] = BitMask.from_bool(mask) if packed else mask
+    return out
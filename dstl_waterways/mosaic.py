@@ -0,0 +1,199 @@
+import os
+
+import numpy as np
+
+from dstl_waterways.scene import Scene
+
+# Virtual mosaic of the DSTL grid: ImageId '6080_4_3' is the cell in row 4,
+# column 3 of the 5x5 cells of grid square 6080. A HaloScene is one cell with
+# every product widened by a halo of pixels borrowed from its eight
+# neighbours, so resampling and morphology see across the seams, and cropping
+# the results back to the cell gives per-tile masks that agree along tile
+# borders. Only the cell and the edge strips of its neighbours are ever read.
+#
+#   scene = HaloScene('6080_4_3', data_dir)
+#   masks = PIPELINE.evaluate(['NDWI_mask'], {'scene': scene})
+#   ndwi = scene.crop(masks['NDWI_mask'])
+#
+# write_mosaic then pastes per-tile masks into one raster per grid square,
+# through a memory-mapped TIFF, never holding the mosaic in memory.
+#
+# Cells of one grid square differ by a pixel or two in size, so a
+# neighbour's strip is cropped or edge-padded to the length of the edge it
+# continues, and in the mosaic each cell starts at the largest size of the
+# cells before it, leaving a gap of up to a few pixels. Nor do the halos
+# keep a cell's M to RGB (or A to M) size ratio exactly, so the resampled
+# masks (FAUX_CCCI, CCCI_SWIR) shift by a hundredth of a pixel or so and a
+# few pixels right at their thresholds can flip; the others only change
+# within MORPHOLOGY_HALO of the seams.
+
+GRID_CELLS = 5
+# halo per product, the same ground distance on every grid: 25 M pixels, 4 A
+# pixels (M / A = 6.25) and 100 RGB / P pixels (RGB / M = 4), well beyond
+# what the morphology (masks.MORPHOLOGY_HALO) and the resize kernels reach
+HALO = {'A': 4, 'M': 25, 'RGB': 100, 'P': 100}
+
+# offsets of the eight neighbours, (rows, cols)
+NEIGHBOURS = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1) if (dr, dc) != (0, 0)]
+
+
+def tile_position(image_id):
+    # '6080_4_3' -> ('6080', 4, 3)
+    grid, row, col = image_id.split('_')
+    return grid, int(row), int(col)
+
+
+def tile_id(grid, row, col):
+    return '{}_{}_{}'.format(grid, row, col)
+
+
+def neighbour_ids(image_id):
+    # {(row offset, col offset): ImageId} of the cells around image_id that
+    # are inside its grid square
+    grid, row, col = tile_position(image_id)
+    return {(dr, dc): tile_id(grid, row + dr, col + dc) for dr, dc in NEIGHBOURS
+            if 0 <= row + dr < GRID_CELLS and 0 <= col + dc < GRID_CELLS}
+
+
+def _side(offset, n, size, before, after):
+    # (slice of the widened axis, slice of a neighbour's axis of the given
+    # size, edge padding) for a neighbour before (-1), level with (0) or after
+    # (1) the cell, on an axis of n pixels widened by before and after: the
+    # neighbour's last or first pixels, padded on the side away from the cell
+    # when it is too short
+    if offset < 0:
+        take = min(before, size)
+        return slice(0, before), slice(size - take, size), (before - take, 0)
+    if offset > 0:
+        take = min(after, size)
+        return slice(before + n, before + n + after), slice(0, take), (0, after - take)
+    take = min(n, size)
+    return slice(before, before + n), slice(0, take), (0, n - take)
+
+
+def widen(centre, neighbours, pads):
+    # centre (bands, rows, cols) or (rows, cols) widened by pads ((top,
+    # bottom), (left, right)) pixels taken from neighbours {(row offset, col
+    # offset): array}, the centre's edge repeated where a neighbour is missing
+    flat = centre.ndim == 2
+    centre = np.asarray(centre)
+    if flat:
+        centre = centre[None]
+    rows, cols = centre.shape[1:]
+    out = np.pad(centre, ((0, 0),) + tuple(pads), mode='edge')
+    for (dr, dc), neighbour in neighbours.items():
+        if flat:
+            neighbour = neighbour[None]
+        out_rows, src_rows, pad_rows = _side(dr, rows, neighbour.shape[1], *pads[0])
+        out_cols, src_cols, pad_cols = _side(dc, cols, neighbour.shape[2], *pads[1])
+        if out_rows.start == out_rows.stop or out_cols.start == out_cols.stop:
+            continue
+        # only this strip of the (memory-mapped) neighbour is read
+        strip = np.asarray(neighbour[:, src_rows, src_cols])
+        if pad_rows != (0, 0) or pad_cols != (0, 0):
+            strip = np.pad(strip, ((0, 0), pad_rows, pad_cols), mode='edge')
+        out[:, out_rows, out_cols] = strip
+    return out[0] if flat else out
+
+
+class HaloScene(Scene):
+    # a Scene whose products carry a halo from the neighbouring cells; the
+    # pipeline runs on it unchanged, and crop() cuts its results back to the
+    # cell. A side without a neighbour gets no halo, so the outer edges of
+    # the data (and a cell with no neighbours at all) come out as they do
+    # when the cell is processed alone.
+
+    def __init__(self, image_id, data_dir='.', catalog=None, halo=HALO):
+        Scene.__init__(self, image_id, data_dir, catalog)
+        self.halo = halo
+        self.neighbours = {}
+        for offset, neighbour_id in neighbour_ids(image_id).items():
+            scene = Scene(neighbour_id, data_dir, catalog)
+            # the M product decides whether a neighbour is there, so every
+            # product is widened on the same sides
+            if os.path.exists(scene.path('M')):
+                self.neighbours[offset] = scene
+        # (top, bottom, left, right): whether that side borrows a halo
+        self.sides = tuple(offset in self.neighbours for offset in ((-1, 0), (1, 0), (0, -1), (0, 1)))
+        self._cells = {}
+
+    def pads(self, product):
+        # ((top, bottom), (left, right)) halo of a product's grid
+        top, bottom, left, right = (self.halo[product] * side for side in self.sides)
+        return (top, bottom), (left, right)
+
+    def cell(self, product):
+        # the cell's own product, without the halo
+        if product not in self._cells:
+            self._cells[product] = Scene.product(self, product)
+        return self._cells[product]
+
+    def product(self, product):
+        if product not in self._products:
+            neighbours = {}
+            for offset, scene in self.neighbours.items():
+                try:
+                    neighbours[offset] = scene.product(product)
+                except (IOError, OSError):
+                    # a product missing next door: the cell's own edge is repeated instead
+                    pass
+            self._products[product] = widen(self.cell(product), neighbours, self.pads(product))
+        return self._products[product]
+
+    def identity(self, product):
+        # results depend on the neighbours as well, which a disk cache key does not cover
+        raise ValueError('halo scenes cannot be disk cached')
+
+    def crop(self, raster):
+        # a raster computed on a widened grid cut back to the cell; the grid
+        # is told by the raster's shape
+        shape = raster.shape[-2:]
+        for product in ('M', 'RGB', 'A', 'P'):
+            try:
+                rows, cols = self.cell(product).shape[-2:]
+            except (IOError, OSError):
+                continue
+            (top, bottom), (left, right) = self.pads(product)
+            if shape == (top + rows + bottom, left + cols + right):
+                return raster[..., top:top + rows, left:left + cols]
+        raise ValueError('raster of shape {} is on none of the widened grids'.format(raster.shape))
+
+
+def mosaic_layout(shapes):
+    # {(row, col): (row offset, col offset)} and the mosaic shape for cells
+    # of the given {(row, col): (rows, cols)}, each row of cells as tall as
+    # its tallest cell and each column as wide as its widest
+    heights = {}
+    widths = {}
+    for (row, col), (rows, cols) in shapes.items():
+        heights[row] = max(heights.get(row, 0), rows)
+        widths[col] = max(widths.get(col, 0), cols)
+    row_starts = np.cumsum([0] + [heights.get(row, 0) for row in range(GRID_CELLS)])
+    col_starts = np.cumsum([0] + [widths.get(col, 0) for col in range(GRID_CELLS)])
+    offsets = {(row, col): (int(row_starts[row]), int(col_starts[col])) for row, col in shapes}
+    return offsets, (int(row_starts[-1]), int(col_starts[-1]))
+
+
+def write_mosaic(path, tiles):
+    # pastes the per-tile rasters {ImageId: TIFF path} of one grid square
+    # into one TIFF at path, one tile in memory at a time; returns path
+    import tifffile as tiff
+    shapes = {}
+    dtype = None
+    for image_id, tile_path in tiles.items():
+        with tiff.TiffFile(tile_path) as tif:
+            shapes[tile_position(image_id)[1:]] = tif.series[0].shape[-2:]
+            dtype = tif.series[0].dtype
+    offsets, shape = mosaic_layout(shapes)
+    out = tiff.memmap(path, shape=shape, dtype=dtype)
+    for image_id, tile_path in tiles.items():
+        r0, c0 = offsets[tile_position(image_id)[1:]]
+        tile = tiff.imread(tile_path)
+        out[r0:r0 + tile.shape[0], c0:c0 + tile.shape[1]] = tile
+        out.flush()
+    del out
+    return path
+
+
+def mosaic_path(out_dir, grid, name):
+    return os.path.join(out_dir, '{}_{}_mosaic.tif'.format(grid, name))
@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from dstl_waterways.atomic import atomic_write
+from dstl_waterways.render import downsample
+from dstl_waterways.stretch import cut_points
+
+# Overview pyramid: the RGB, panchromatic and index rasters of a scene at 1/2,
+# 1/4 and 1/8 of their size, already stretched to uint8, in one sidecar .npz
+# per scene. A viewer reads only the level that fits its viewport, a few
+# hundred KB to a few MB, instead of stretching the full 3350x3338 arrays.
+#
+#   python overviews.py --ids 6120_2_2 6070_2_3 --data-dir .
+#   rgb = overview(Scene('6120_2_2'), 'RGB', viewport=(800, 800))
+#
+# Sidecars go to the overviews/ directory of the scene's data directory
+# unless a cache_dir is given. Each records the identity (path, size,
+# mtime) of the products it was built from, and overview() rebuilds it when
+# a product's file has changed since.
+#
+# Every level uses the 2% / 98% cut points of the full resolution product
+# (as stretch_uint8 does), so all levels look alike. Index rasters are
+# stretched over the ranges display() shows them with.
+
+LEVELS = (2, 4, 8)
+# the sidecar directory, under the data directory
+OVERVIEW_DIR = 'overviews'
+
+# index -> (vmin, vmax) of its display() panel; None for the data range
+INDEX_RANGES = {
+    'CCCI_NIR2': (-.5, .5),
+    'NDWI': (-.3, .3),
+    'NDVI': None,
+    'EVI': (-.5, .5),
+    'SAVI': None,
+    'CCCI_SWIR': (.6, 1.2),
+    'FAUX_CCCI': (-.4, .4),
+}
+
+
+def overview_path(cache_dir, image_id):
+    return os.path.join(cache_dir, '{}_overviews.npz'.format(image_id))
+
+
+def default_cache_dir(scene):
+    return os.path.join(scene.data_dir, OVERVIEW_DIR)
+
+
+def pyramid(a, levels=LEVELS):
+    # {level: a block-averaged by level}, each level made from the one before
+    # it when it divides it, so the full raster is only read once
+    out = {}
+    previous, previous_level = a, 1
+    for level in sorted(levels):
+        if level % previous_level == 0:
+            out[level] = downsample(previous, level // previous_level)
+        else:
+            out[level] = downsample(a, level)
+        previous, previous_level = out[level], level
+    return out
+
+
+def to_uint8(a, lo, hi):
+    # linear stretch of lo .. hi to 0 .. 255, truncated like stretch_uint8
+    lo = np.asarray(lo, dtype=np.float32)
+    hi = np.asarray(hi, dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = (a - lo) * (255 / (hi - lo))
+    return np.clip(np.nan_to_num(scaled), 0, 255).astype(np.uint8)
+
+
+def build_overviews(scene, cache_dir=None, indices=None, levels=LEVELS, products=('RGB', 'P')):
+    # writes the sidecar of a scene.Scene to cache_dir (default_cache_dir if
+    # None) and returns its path; indices is an optional {index name: raster}
+    cache_dir = cache_dir or default_cache_dir(scene)
+    # {product: Scene.identity}, to tell when the sidecar is out of date
+    arrays = {'sources': np.array(json.dumps({product: scene.identity(product) for product in products}))}
+    for product in products:
+        data = scene.rgb if product == 'RGB' else scene.product(product)
+        lo, hi = cut_points(data)
+        if data.ndim == 2:
+            lo, hi = lo[0], hi[0]
+        for level, small in pyramid(data, levels).items():
+            arrays['{}/{}'.format(product, level)] = to_uint8(small, lo, hi)
+    for name, raster in (indices or {}).items():
+        value_range = INDEX_RANGES.get(name) or (float(raster.min()), float(raster.max()))
+        arrays['{}/range'.format(name)] = np.array(value_range)
+        # clipped first, so the -inf clamp of safe_divide does not swamp the block means
+        raster = np.clip(raster, value_range[0], value_range[1])
+        for level, small in pyramid(raster, levels).items():
+            arrays['{}/{}'.format(name, level)] = to_uint8(small, *value_range)
+
+    path = overview_path(cache_dir, scene.image_id)
+    # replaced atomically, so a viewer never reads half a file
+    with atomic_write(path) as f:
+        np.savez_compressed(f, **arrays)
+    return path
+
+
+class Overviews(object):
+    # read access to the sidecar of one scene; arrays are only read when asked for
+
+    def __init__(self, image_id, cache_dir):
+        self.image_id = image_id
+        self.path = overview_path(cache_dir, image_id)
+        self._file = np.load(self.path)
+
+    def levels(self, name):
+        # available levels of a product or index, finest first
+        prefix = name + '/'
+        return sorted(int(key[len(prefix):]) for key in self._file.files
+                      if key.startswith(prefix) and key[len(prefix):].isdigit())
+
+    def read(self, name, level):
+        # uint8 (rows, cols) or, for RGB, (rows, cols, 3)
+        return self._file['{}/{}'.format(name, level)]
+
+    def source(self, product):
+        # Scene.identity of the file a product was built from, None if unknown
+        if 'sources' not in self._file.files:
+            return None
+        identity = json.loads(str(self._file['sources'])).get(product)
+        return None if identity is None else tuple(identity)
+
+    def value_range(self, name):
+        # (vmin, vmax) an index was stretched over, i.e. what 0 and 255 stand for
+        return tuple(self._file['{}/range'.format(name)])
+
+    def level_for(self, name, shape, viewport):
+        # the coarsest level still covering viewport (rows, cols) of a raster of
+        # the given full resolution shape, or the finest level if none does
+        levels = self.levels(name)
+        for level in reversed(levels):
+            if -(-shape[0] // level) >= viewport[0] and -(-shape[1] // level) >= viewport[1]:
+                return level
+        return levels[0]
+
+    def close(self):
+        self._file.close()
+
+
+def overview(scene, name, viewport, cache_dir=None):
+    # the level of a scene's RGB or P product that fits viewport, building
+    # the sidecar first if there is none or it was built from another file
+    cache_dir = cache_dir or default_cache_dir(scene)
+    overviews = None
+    if os.path.exists(overview_path(cache_dir, scene.image_id)):
+        overviews = Overviews(scene.image_id, cache_dir)
+        if overviews.source(name) != scene.identity(name):
+            overviews.close()
+            overviews = None
+    if overviews is None:
+        build_overviews(scene, cache_dir)
+        overviews = Overviews(scene.image_id, cache_dir)
+    full_shape = scene.product(name).shape[-2:]
+    try:
+        return overviews.read(name, overviews.level_for(name, full_shape, viewport))
+    finally:
+        overviews.close()
+
+
+def main(argv=None):
+    from dstl_waterways.batch import select_image_ids
+    from dstl_waterways.catalog import load_catalog
+    from dstl_waterways.indices import INDICES
+    from dstl_waterways.pipeline import PIPELINE, products_for
+    from dstl_waterways.prefetch import prefetch_scenes
+
+    parser = argparse.ArgumentParser(description='Build stretched overview pyramids for fast viewing.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--ids', nargs='+', help='ImageIds to build overviews for')
+    source.add_argument('--class-type', type=int, help='the ImageIds with polygons of this class in --csv')
+    parser.add_argument('--csv', default='train_wkt_v4.csv')
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--cache-dir', default=None,
+                        help='where to write the sidecars (default: DATA_DIR/{})'.format(OVERVIEW_DIR))
+    parser.add_argument('--indices', nargs='*', default=[name for name in INDICES if name != 'FAUX_CCCI'],
+                        choices=INDICES, help='index rasters to add to the overviews')
+    parser.add_argument('--prefetch', type=int, default=2, help='scenes read ahead in the background (0: none)')
+    parser.add_argument('--catalog', metavar='PATH', default=None,
+                        help='dataset catalog to select images and open products with')
+    args = parser.parse_args(argv)
+
+    catalog = load_catalog(args.catalog) if args.catalog else None
+    image_ids = args.ids or select_image_ids(args.csv, args.class_type, catalog)
+    products = set(products_for(args.indices)) | {'RGB', 'P'}
+    for image_id, scene in prefetch_scenes(image_ids, args.data_dir, products, depth=args.prefetch,
+                                           catalog=catalog):
+        indices = PIPELINE.evaluate(args.indices, {'scene': scene}) if args.indices else {}
+        print(build_overviews(scene, args.cache_dir, indices))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
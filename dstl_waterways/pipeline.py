@@ -0,0 +1,143 @@
+from dstl_waterways import masks
+from dstl_waterways.graph import Graph, Node
+from dstl_waterways.histogram import HISTOGRAM_BINS, Histogram
+from dstl_waterways.indices import INDICES, NEEDS_RGB, NEEDS_SWIR, SAVI_L, SceneTerms, compute_index, grid_shape
+from dstl_waterways.quantize import QUANTIZE_RANGES, Quantized, quantize_index, quantize_params
+from dstl_waterways.stretch import stretch_01
+
+# The per-image pipeline of display() as a lazy graph. The only input is
+# 'scene' (a scene.Scene); outputs are
+#   'RGB_stretched'           - stretched RGB quicklook
+#   '<index>'                 - index rasters, see indices.INDICES; quantize.Quantized
+#                               rasters with the 'quantize' setting
+#   '<mask>_mask'             - bool masks, see masks.MASKS
+#   '<index>_hist'            - histogram.Histogram of an index, see HISTOGRAM_BINS
+# e.g. PIPELINE.evaluate(['NDWI_mask'], {'scene': scene}) reads the M bands
+# and computes NDWI only.
+
+DEFAULTS = {
+    'SAVI_L': SAVI_L,
+    'CCCI_THRESHOLD_U': masks.CCCI_THRESHOLD_U,
+    'CCCI_THRESHOLD_L': masks.CCCI_THRESHOLD_L,
+    'FAUX_CCCI_THRESHOLD': masks.FAUX_CCCI_THRESHOLD,
+    'CCCI_SWIR_THRESHOLD': masks.CCCI_SWIR_THRESHOLD,
+    'NDWI_THRESHOLD': masks.NDWI_THRESHOLD,
+    'NDVI_THRESHOLD': masks.NDVI_THRESHOLD,
+    # mask cleanup, see masks.CLEANUPS
+    'cleanup': 'morphology',
+    'MIN_COMPONENT_AREA': masks.MIN_COMPONENT_AREA,
+    'MIN_ELONGATION': masks.MIN_ELONGATION,
+    'MAX_HOLE_AREA': masks.MAX_HOLE_AREA,
+    # an indices.Workspace to take the intermediate arrays from
+    'workspace': None,
+    # grid the indices and masks are computed on, see indices.RESOLUTIONS
+    'resolution': 'native',
+    # a diskcache.DiskCache keeping index rasters and resampled bands across runs
+    'disk_cache': None,
+    # dtypes of the resampled bands, see indices.PRECISIONS
+    'precision': 'float64',
+    # None for float32 index rasters, or 'int16' / 'uint8' to keep them
+    # quantized, see quantize.py; masks threshold the codes directly
+    'quantize': None,
+}
+
+# threshold mask -> parameter holding its threshold
+_THRESHOLD_PARAMS = {
+    'NDWI': 'NDWI_THRESHOLD',
+    'NDVI': 'NDVI_THRESHOLD',
+    'FAUX_CCCI': 'FAUX_CCCI_THRESHOLD',
+    'CCCI_SWIR': 'CCCI_SWIR_THRESHOLD',
+}
+
+_CLEANUP_PARAMS = {
+    'cleanup': 'cleanup',
+    'min_area': 'MIN_COMPONENT_AREA',
+    'min_elongation': 'MIN_ELONGATION',
+    'max_hole_area': 'MAX_HOLE_AREA',
+}
+
+
+def _index_node(name):
+    # index nodes share one SceneTerms, and only depend on the SWIR or RGB
+    # products when the index needs them, so those are never opened otherwise
+    if name in NEEDS_SWIR:
+        extra, products = ('A',), ('M', 'A')
+    elif name in NEEDS_RGB:
+        extra, products = ('RGB',), ('M', 'RGB')
+    else:
+        extra, products = (), ('M',)
+
+    def compute(scene, terms, *data, L=SAVI_L, disk_cache=None, resolution='native', quantize=None):
+        if name in NEEDS_SWIR:
+            terms.swirdata = data[0]
+        elif name in NEEDS_RGB:
+            terms.rgbdata = data[0]
+
+        def raster():
+            # with quantize the float32 index is dropped as soon as it is
+            # coded, so only the codes are held between nodes
+            index = compute_index(terms, name, L)
+            if quantize is None:
+                return index
+            return quantize_index(name, index, quantize, work=terms.scratch('quantize', index.shape)).codes
+
+        if disk_cache is None:
+            out = raster()
+        else:
+            # keyed on the files the index reads and the parameters it depends on,
+            # so a new L only recomputes SAVI
+            sources = products if resolution in ('native', 'ms') else products + ('RGB',)
+            parts = ('index', name, tuple(scene.identity(product) for product in sorted(set(sources))),
+                     resolution, L if name == 'SAVI' else None)
+            if terms.precision != 'float64' or quantize is not None:
+                parts += (terms.precision, quantize)
+            out = disk_cache.get_or_compute(parts, raster)
+        if quantize is None:
+            return out
+        return Quantized(out, *quantize_params(QUANTIZE_RANGES[name], quantize))
+
+    return Node(name, compute, ('scene', 'terms') + extra,
+                {'L': 'SAVI_L', 'disk_cache': 'disk_cache', 'resolution': 'resolution', 'quantize': 'quantize'})
+
+
+def _terms(scene, m, workspace, resolution, disk_cache, precision):
+    # the RGB product is only opened, not read, for its shape
+    rgb_shape = None if resolution in ('native', 'ms') else scene.product('RGB').shape[1:]
+    return SceneTerms(m, image_id=scene.image_id, workspace=workspace,
+                      grid=grid_shape(resolution, m.shape[1:], rgb_shape),
+                      disk_cache=disk_cache, source=scene.identity, precision=precision)
+
+
+def _histogram_node(name):
+    value_range, bins = HISTOGRAM_BINS[name]
+    return Node(name + '_hist', lambda index: Histogram(value_range, bins).update(index), (name,))
+
+
+def build_pipeline():
+    nodes = [
+        Node('M', lambda scene: scene.m, ('scene',)),
+        Node('A', lambda scene: scene.a, ('scene',)),
+        Node('RGB', lambda scene: scene.rgb, ('scene',)),
+        Node('terms', _terms, ('scene', 'M'),
+             {'workspace': 'workspace', 'resolution': 'resolution', 'disk_cache': 'disk_cache',
+              'precision': 'precision'}),
+        Node('RGB_stretched', stretch_01, ('RGB',)),
+        Node('CCCI_NIR2_mask', masks.ccci_mask, ('CCCI_NIR2',),
+             dict(_CLEANUP_PARAMS, upper='CCCI_THRESHOLD_U', lower='CCCI_THRESHOLD_L')),
+    ]
+    nodes += [_index_node(name) for name in INDICES]
+    nodes += [Node(name + '_mask', masks.threshold_mask, (masks.mask_index(name),),
+                   dict(_CLEANUP_PARAMS, threshold=param))
+              for name, param in _THRESHOLD_PARAMS.items()]
+    nodes += [_histogram_node(name) for name in HISTOGRAM_BINS]
+    return Graph(nodes, DEFAULTS)
+
+
+PIPELINE = build_pipeline()
+
+
+def products_for(outputs, graph=PIPELINE):
+    # the scene products ('RGB', 'M', 'A') evaluating outputs reads, e.g. to
+    # know what to prefetch
+    needed = graph.subgraph(outputs, ('scene',))
+    return tuple(product for product in ('RGB', 'M', 'A') if product in needed)
@@ -0,0 +1,57 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dstl_waterways import profiling
+from dstl_waterways.scene import Scene
+
+# Background prefetch for the per-image loops: while one scene is being
+# computed or plotted, a small thread pool reads the TIFFs of the next ones,
+# so read latency (network storage in particular) overlaps with compute.
+# Only `depth` scenes are ever read ahead, which bounds the memory held.
+#
+#   for image_id, scene in prefetch_scenes(image_ids, products=('M', 'RGB')):
+#       display(image_id, scene=scene)
+
+DEFAULT_DEPTH = 2
+
+
+def prefetch(items, load, depth=DEFAULT_DEPTH, workers=None):
+    # yields (item, load(item)) in the order of items, with up to depth loads
+    # running or finished ahead of the item being consumed; an error from
+    # load is raised when its item is reached. depth 0 (or less) loads each
+    # item only when it is reached, without a thread pool
+    if depth <= 0:
+        for item in items:
+            yield item, load(item)
+        return
+    workers = workers or depth
+    items = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for item in items:
+                pending.append((item, pool.submit(load, item)))
+                if len(pending) >= depth:
+                    break
+            while pending:
+                item, future = pending.popleft()
+                result = future.result()
+                # the next read only starts once a slot is free: backpressure
+                for following in items:
+                    pending.append((following, pool.submit(load, following)))
+                    break
+                yield item, result
+        finally:
+            # consumer stopped early: drop the reads that have not started
+            for _, future in pending:
+                future.cancel()
+
+
+def prefetch_scenes(image_ids, data_dir='.', products=('RGB', 'M', 'A'), depth=DEFAULT_DEPTH, workers=None,
+                    catalog=None):
+    # yields (image_id, Scene) with the given products already in memory;
+    # catalog is an optional catalog.Catalog the scenes are opened through
+    def load(image_id):
+        with profiling.stage('load', image_id=image_id):
+            return Scene(image_id, data_dir, catalog).load(products)
+    return prefetch(image_ids, load, depth, workers)
@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Per-stage instrumentation: wall time, CPU time and peak allocation of named
+# stages (reads, resizes, every pipeline node, writes, plots), tagged with
+# the image they ran for. Off by default and free when off; switch it on with
+# enable(), batch.py --profile, or the WATERWAYS_PROFILE environment variable
+# naming a JSON lines file to append records to:
+#
+#   WATERWAYS_PROFILE=profile.jsonl python waterways_with_histograms.py
+#   python batch.py --ids 6080_4_3 --out masks --profile profile.jsonl
+#
+# Records from any number of processes append to the same file. The file
+# converts to Chrome trace-event JSON (chrome://tracing, Perfetto) with
+# write_chrome_trace, and summary() totals it per stage. count() records
+# events that take no time of their own, such as cache hits and misses, and
+# summary() totals those too.
+#
+# Stages nest: a stage's time and peak include its children. CPU time is that
+# of the thread running the stage; the allocation peak is process wide.
+# Memory-mapped bands are read on first touch, so that I/O shows up in the
+# stage that first uses a band unless the scene was loaded (Scene.load).
+
+ENV_VAR = 'WATERWAYS_PROFILE'
+
+
+class Profiler(object):
+
+    def __init__(self, path=None, memory=True):
+        # path: JSON lines file records are appended to as stages finish
+        self.path = path
+        self.memory = memory
+        self.records = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name, **args):
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        # image_id and other tags carry over from the enclosing stage
+        frame = {'args': dict(parent['args'], **args) if parent else args, 'peak': 0, 'base': 0}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if parent:
+                parent['peak'] = max(parent['peak'], peak)
+            frame['base'] = current
+            tracemalloc.reset_peak()
+        stack.append(frame)
+        ts = time.time()
+        start, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.thread_time() - cpu
+            stack.pop()
+            record = {'stage': name, 'ts': ts, 'wall': wall, 'cpu': cpu, 'depth': len(stack),
+                      'pid': os.getpid(), 'tid': threading.get_ident()}
+            record.update(frame['args'])
+            if self.memory:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                record['peak_mb'] = (peak - frame['base']) / 2.0 ** 20
+                if parent:
+                    parent['peak'] = max(parent['peak'], peak)
+            self._emit(record)
+
+    def count(self, name, **values):
+        # adds values ({counter: increment}) to the counters of name
+        stack = self._stack()
+        record = {'counter': name, 'ts': time.time(), 'values': values,
+                  'pid': os.getpid(), 'tid': threading.get_ident()}
+        if stack:
+            record.update(stack[-1]['args'])
+        self._emit(record)
+
+    def _emit(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.path:
+                # one write per line, so lines from several processes never interleave
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+
+_profiler = None
+
+
+def enable(path=None, memory=True):
+    global _profiler
+    _profiler = Profiler(path, memory)
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def enabled():
+    return _profiler is not None
+
+
+def stage(name, **args):
+    # context manager timing one stage, a no-op unless profiling is enabled
+    if _profiler is None:
+        return nullcontext()
+    return _profiler.stage(name, **args)
+
+
+def count(name, **values):
+    # adds to the counters of name, a no-op unless profiling is enabled
+    if _profiler is not None:
+        _profiler.count(name, **values)
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def chrome_trace(records):
+    # Chrome trace-event format: one complete ('X') event per stage
+    events = []
+    for r in records:
+        if 'stage' not in r:
+            continue
+        args = {k: v for k, v in r.items() if k not in ('stage', 'ts', 'wall', 'pid', 'tid', 'depth')}
+        events.append({'name': r['stage'], 'ph': 'X', 'ts': r['ts'] * 1e6, 'dur': r['wall'] * 1e6,
+                       'pid': r['pid'], 'tid': r['tid'], 'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(path, records):
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(records), f)
+
+
+def summary(records):
+    # table of calls, total and mean wall time, CPU time and largest peak per
+    # stage, slowest first, then the totals of every counter
+    stages = {}
+    counters = {}
+    for r in records:
+        if 'counter' in r:
+            totals = counters.setdefault(r['counter'], {})
+            for key, value in r['values'].items():
+                totals[key] = totals.get(key, 0) + value
+            continue
+        s = stages.setdefault(r['stage'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_mb': 0.0})
+        s['calls'] += 1
+        s['wall'] += r['wall']
+        s['cpu'] += r['cpu']
+        s['peak_mb'] = max(s['peak_mb'], r.get('peak_mb', 0.0))
+    lines = ['{:<22} {:>6} {:>10} {:>10} {:>10} {:>10}'.format(
+        'stage', 'calls', 'wall s', 'mean ms', 'cpu s', 'peak MB')]
+    for name, s in sorted(stages.items(), key=lambda item: -item[1]['wall']):
+        lines.append('{:<22} {:>6} {:>10.3f} {:>10.1f} {:>10.3f} {:>10.1f}'.format(
+            name, s['calls'], s['wall'], s['wall'] / s['calls'] * 1000, s['cpu'], s['peak_mb']))
+    for name, totals in sorted(counters.items()):
+        lines.append('{}: {}'.format(name, ', '.join('{} {}'.format(k, v) for k, v in sorted(totals.items()))))
+    return '\n'.join(lines)
+
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])
@@ -0,0 +1,120 @@
+import numpy as np
+
+# Quantized index rasters: an index kept as int16 or uint8 codes q, with
+# value = offset + scale * q, over a fixed value range per index (values
+# outside it clip to its ends). That is half or a quarter of the float32
+# raster, in memory, in the disk cache and in the written TIFFs.
+#
+#   ndwi = quantize_index('NDWI', compute_index(terms, 'NDWI'), 'int16')
+#   mask = ndwi > NDWI_THRESHOLD
+#
+# Comparisons with a threshold convert the threshold to a code once and
+# compare the integer codes, never decoding the raster, and give exactly the
+# result of comparing the decoded values; so the mask functions work on a
+# Quantized as they are. Any threshold inside an index's range is therefore
+# applied as on the float raster, give or take the pixels within half a
+# step of it: 1/65534 of the range for int16, 1/255 for uint8.
+# np.asarray() decodes to float32, for everything else.
+
+QUANTIZE_DTYPES = ('int16', 'uint8')
+
+# dtype -> (lowest code, highest code); int16 leaves -32768 unused so the
+# codes are symmetric about 0
+_CODES = {
+    'int16': (-32767, 32767),
+    'uint8': (0, 255),
+}
+
+# value range each index is quantized over, holding the thresholds in masks.py
+QUANTIZE_RANGES = {
+    'NDWI': (-1, 1),
+    'NDVI': (-1, 1),
+    'EVI': (-4, 4),
+    'SAVI': (-1.5, 1.5),
+    'CCCI_NIR2': (-8, 8),
+    'CCCI_SWIR': (0, 2),
+    'FAUX_CCCI': (-1, 1),
+}
+
+
+def quantize_params(value_range, dtype):
+    # (scale, offset) mapping the codes of dtype onto value_range
+    if dtype not in _CODES:
+        raise ValueError('cannot quantize to {}, expected one of {}'.format(dtype, QUANTIZE_DTYPES))
+    lo, hi = _CODES[dtype]
+    scale = (value_range[1] - value_range[0]) / float(hi - lo)
+    return scale, value_range[0] - lo * scale
+
+
+class Quantized(object):
+
+    def __init__(self, codes, scale, offset):
+        self.codes = codes
+        self.scale = float(scale)
+        self.offset = float(offset)
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def size(self):
+        return self.codes.size
+
+    @property
+    def dtype(self):
+        return self.codes.dtype
+
+    def __getitem__(self, key):
+        return Quantized(self.codes[key], self.scale, self.offset)
+
+    def dequantize(self, dtype=np.float32):
+        out = self.codes.astype(dtype)
+        out *= self.scale
+        out += self.offset
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        return self.dequantize(dtype or np.float32)
+
+    def _code(self, threshold):
+        # threshold in code units, not rounded
+        return (threshold - self.offset) / self.scale
+
+    def __gt__(self, threshold):
+        # offset + scale * q > t  <=>  q > floor((t - offset) / scale)
+        lo, hi = _CODES[self.codes.dtype.name]
+        code = np.floor(self._code(threshold))
+        if code < lo or code >= hi:
+            return np.full(self.shape, code < lo)
+        return self.codes > int(code)
+
+    def __lt__(self, threshold):
+        # offset + scale * q < t  <=>  q < ceil((t - offset) / scale)
+        lo, hi = _CODES[self.codes.dtype.name]
+        code = np.ceil(self._code(threshold))
+        if code > hi or code <= lo:
+            return np.full(self.shape, code > hi)
+        return self.codes < int(code)
+
+
+def quantize(index, value_range, dtype, work=None):
+    # index (float32) as a Quantized of dtype over value_range; work is an
+    # optional float32 array of index's shape to do the arithmetic in, index
+    # itself is left alone
+    scale, offset = quantize_params(value_range, dtype)
+    lo, hi = _CODES[dtype]
+    work = np.empty(index.shape, dtype=np.float32) if work is None else work
+    np.subtract(index, offset, out=work)
+    # indices clamp -inf to the most negative float32, which overflows here
+    # and then clips to the lowest code like any other value below the range
+    with np.errstate(over='ignore'):
+        work /= scale
+    np.rint(work, out=work)
+    np.clip(work, lo, hi, out=work)
+    return Quantized(work.astype(dtype), scale, offset)
+
+
+def quantize_index(name, index, dtype, work=None):
+    # an index raster quantized over its range in QUANTIZE_RANGES
+    return quantize(index, QUANTIZE_RANGES[name], dtype, work)
@@ -0,0 +1,155 @@
+import struct
+import zlib
+
+import numpy as np
+
+from dstl_waterways.resample import block_mean
+from dstl_waterways.stretch import stretch_01
+
+# Headless quicklooks without matplotlib: every raster is block-averaged down
+# to its panel size first, coloured through a 256 entry lookup table, tiled
+# into one image with the other panels and written as PNG with zlib. No
+# global state, so it is safe in any number of worker processes.
+#
+#   panels = [image_panel(rgb), image_panel(mask, cmap='binary_r'), histogram_panel(hist)]
+#   write_png('quicklook.png', mosaic(panels, ncols=3))
+
+PANEL_SIZE = 256
+BACKGROUND = 255
+
+# matplotlib's viridis at 17 evenly spaced points, interpolated to 256 entries
+_VIRIDIS = [[68, 1, 84], [72, 24, 106], [71, 45, 123], [66, 64, 134], [59, 82, 139], [51, 99, 141],
+            [44, 114, 142], [38, 130, 142], [33, 145, 140], [31, 160, 136], [40, 174, 128],
+            [63, 188, 115], [94, 201, 98], [132, 212, 75], [173, 220, 48], [216, 226, 25], [253, 231, 37]]
+# matplotlib's default bar colour
+BAR_COLOUR = (31, 119, 180)
+
+
+def _lut(anchors):
+    anchors = np.asarray(anchors, dtype=np.float64)
+    x = np.linspace(0, 1, len(anchors))
+    t = np.linspace(0, 1, 256)
+    return np.round(np.stack([np.interp(t, x, anchors[:, i]) for i in range(3)], axis=-1)).astype(np.uint8)
+
+
+COLORMAPS = {
+    'viridis': _lut(_VIRIDIS),
+    'gray': _lut([[0, 0, 0], [255, 255, 255]]),
+    'binary_r': _lut([[0, 0, 0], [255, 255, 255]]),
+    'binary': _lut([[255, 255, 255], [0, 0, 0]]),
+}
+
+
+def downsample(a, factor):
+    # a shrunk factor times over its first two axes (rounding up) by
+    # resample.block_mean, blocks of factor or factor - 1 pixels a side
+    if factor <= 1:
+        return np.asarray(a, dtype=np.float32)
+    return block_mean(a, (-(-a.shape[0] // factor), -(-a.shape[1] // factor)))
+
+
+def fit(a, size=PANEL_SIZE):
+    # a downsampled by the smallest whole factor that fits it in size x size
+    factor = -(-max(a.shape[0], a.shape[1]) // size)
+    return downsample(a, factor)
+
+
+def colorize(a, cmap='viridis', vmin=None, vmax=None):
+    # (rows, cols) values -> (rows, cols, 3) uint8 through a colormap; vmin and
+    # vmax default to the data range, as in imshow
+    lut = COLORMAPS[cmap]
+    vmin = float(np.min(a)) if vmin is None else vmin
+    vmax = float(np.max(a)) if vmax is None else vmax
+    scale = 255.0 / (vmax - vmin) if vmax > vmin else 0.0
+    idx = np.clip((a - vmin) * scale, 0, 255).astype(np.uint8)
+    return lut[idx]
+
+
+def _centre(img, size):
+    panel = np.full((size, size, 3), BACKGROUND, dtype=np.uint8)
+    r0 = (size - img.shape[0]) // 2
+    c0 = (size - img.shape[1]) // 2
+    panel[r0:r0 + img.shape[0], c0:c0 + img.shape[1]] = img
+    return panel
+
+
+def image_panel(a, size=PANEL_SIZE, cmap='viridis', vmin=None, vmax=None):
+    # (size, size, 3) uint8 panel of a raster; (rows, cols, 3) arrays are
+    # taken as RGB in [0, 1], anything else is coloured through cmap
+    small = fit(a, size)
+    if small.ndim == 3:
+        img = (np.clip(small, 0, 1) * 255).astype(np.uint8)
+    else:
+        img = colorize(small, cmap, vmin, vmax)
+    return _centre(img, size)
+
+
+def histogram_panel(hist, size=PANEL_SIZE, width=0.7):
+    # bar chart of histogram counts, bars width of a bin wide, as in display()
+    hist = np.asarray(hist, dtype=np.float64)
+    panel = np.full((size, size, 3), BACKGROUND, dtype=np.uint8)
+    peak = hist.max()
+    if not peak:
+        return panel
+    heights = np.round(hist / peak * (size - 1)).astype(int)
+    step = size / float(len(hist))
+    for i, h in enumerate(heights):
+        left = int(round((i + (1 - width) / 2) * step))
+        right = max(left + 1, int(round((i + (1 + width) / 2) * step)))
+        panel[size - h:, left:right] = BAR_COLOUR
+    return panel
+
+
+def mosaic(panels, ncols=None, pad=4):
+    # panels of one size tiled row by row, pad pixels of background between them
+    ncols = ncols or len(panels)
+    nrows = -(-len(panels) // ncols)
+    h, w = panels[0].shape[:2]
+    out = np.full((nrows * h + (nrows + 1) * pad, ncols * w + (ncols + 1) * pad, 3), BACKGROUND, dtype=np.uint8)
+    for i, panel in enumerate(panels):
+        r = pad + (i // ncols) * (h + pad)
+        c = pad + (i % ncols) * (w + pad)
+        out[r:r + h, c:c + w] = panel
+    return out
+
+
+def _chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def encode_png(img, level=6):
+    # PNG bytes of a (rows, cols) grey or (rows, cols, 3) RGB uint8 image
+    img = np.ascontiguousarray(img, dtype=np.uint8)
+    rows, cols = img.shape[:2]
+    colour_type = 2 if img.ndim == 3 else 0
+    # every scanline starts with filter type 0 (none)
+    raw = np.zeros((rows, 1 + img[0].size), dtype=np.uint8)
+    raw[:, 1:] = img.reshape(rows, -1)
+    return (b'\x89PNG\r\n\x1a\n' +
+            _chunk(b'IHDR', struct.pack('>IIBBBBB', cols, rows, 8, colour_type, 0, 0, 0)) +
+            _chunk(b'IDAT', zlib.compress(raw.tobytes(), level)) +
+            _chunk(b'IEND', b''))
+
+
+def write_png(path, img, level=6):
+    # path may also be an open binary file
+    data = encode_png(img, level)
+    if hasattr(path, 'write'):
+        path.write(data)
+    else:
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+def quicklook(rgb, masks, hists=(), size=PANEL_SIZE):
+    # one image with the stretched RGB and the masks on the first row and the
+    # histogram counts, if any, on the second, like the display() figures;
+    # rgb is (rows, cols, 3) raw counts, masks and hists are lists of arrays
+    panels = [image_panel(stretch_01(fit(rgb, size)), size)]
+    panels += [image_panel(mask, size, cmap='binary_r', vmin=0, vmax=1) for mask in masks]
+    ncols = len(panels)
+    if hists:
+        panels.append(np.full((size, size, 3), BACKGROUND, dtype=np.uint8))
+        panels += [histogram_panel(hist, size) for hist in hists]
+        ncols = max(ncols, len(hists) + 1)
+    return mosaic(panels, ncols)
@@ -0,0 +1,117 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from dstl_waterways import profiling
+
+# Memoised band resampling. Upsampling an M band to the 3350x3338 RGB grid is
+# the most expensive step per image, and several indices need the same
+# upsampled band (RE, NIR2, SWIR_1), so results are kept in a memory-bounded
+# LRU keyed on (image, sensor, band, target shape, resize options).
+# A cache serves one image: indices.SceneTerms makes its own, so the bands
+# are freed with the scene's terms instead of piling up in a worker that
+# moves on to the next image. Hits, misses and evictions are counted under
+# 'resample_cache' in the profile (see profiling.count).
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _resize(data, shape, work_dtype=None, **options):
+    # skimage.transform.resize, imported on the first resize as it pulls in scipy
+    # with work_dtype=np.float32 the band is converted to float32 first (and
+    # scaled to [0, 1] as resize would without preserve_range), so the resize
+    # runs in single precision instead of double
+    from skimage.transform import resize
+    if work_dtype is not None:
+        from skimage.util import img_as_float32
+        data = np.asarray(data)
+        data = data.astype(work_dtype) if options.get('preserve_range') else img_as_float32(data)
+    return resize(data, shape, **options)
+
+
+class ResampleCache(object):
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def resize(self, image_id, sensor, band, data, shape, dtype=None, work_dtype=None, **options):
+        # resize(data, shape, **options), optionally cast to dtype, where data is
+        # band `band` (a WV3 enum member or band number) of product `sensor`
+        # ('M', 'A', ...) of image_id; work_dtype as for _resize. Returned
+        # arrays are shared, so read-only.
+        band = getattr(band, 'value', band)
+        key = (image_id, sensor, band, tuple(shape), np.dtype(dtype).str if dtype else None,
+               np.dtype(work_dtype).str if work_dtype else None, tuple(sorted(options.items())))
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            profiling.count('resample_cache', hits=1)
+            return self._entries[key]
+
+        self.misses += 1
+        profiling.count('resample_cache', misses=1)
+        with profiling.stage('resize', sensor=sensor, band=getattr(band, 'value', band)):
+            out = _resize(data, shape, work_dtype, **options)
+        if dtype is not None:
+            out = out.astype(dtype, copy=False)
+        out.setflags(write=False)
+        if out.nbytes <= self.max_bytes:
+            self._entries[key] = out
+            self.nbytes += out.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+                profiling.count('resample_cache', evictions=1)
+        return out
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'nbytes': self.nbytes}
+
+
+def resize_band(image_id, sensor, band, data, shape, dtype=None, cache=None, work_dtype=None, **options):
+    # resize through cache (a ResampleCache) if given; without an image_id
+    # there is nothing to key on
+    if image_id is None or cache is None:
+        with profiling.stage('resize', sensor=sensor, band=getattr(band, 'value', band)):
+            out = _resize(data, shape, work_dtype, **options)
+        return out if dtype is None else out.astype(dtype, copy=False)
+    return cache.resize(image_id, sensor, band, data, shape, dtype=dtype, work_dtype=work_dtype, **options)
+
+
+def _block_edges(n_in, n_out):
+    # start of each of n_out nearly equal blocks covering n_in pixels
+    return np.arange(n_out) * n_in // n_out
+
+
+def block_mean(data, shape, dtype=np.float32):
+    # data (rows, cols, ...) averaged down to shape (rows, cols), each output
+    # pixel the mean of the block of input pixels it covers; for shrinking
+    # only, and cheaper than resize() since every input pixel is read once
+    rows = _block_edges(data.shape[0], shape[0])
+    cols = _block_edges(data.shape[1], shape[1])
+    # float32 sums of 16 bit values are exact for blocks of up to 256 pixels
+    out = np.add.reduceat(np.add.reduceat(data, rows, axis=0, dtype=np.float32), cols, axis=1, dtype=np.float32)
+    sizes = np.outer(np.diff(np.append(rows, data.shape[0])), np.diff(np.append(cols, data.shape[1])))
+    out /= sizes.reshape(sizes.shape + (1,) * (out.ndim - 2))
+    return out.astype(dtype, copy=False)
+
+
+def upsample_nearest(mask, shape):
+    # mask (rows, cols) enlarged to shape by nearest neighbour, for masks
+    # computed on a coarser grid than they are wanted on
+    if mask.shape == tuple(shape):
+        return mask
+    rows = ((np.arange(shape[0]) + 0.5) * mask.shape[0] / shape[0]).astype(np.intp)
+    cols = ((np.arange(shape[1]) + 0.5) * mask.shape[1] / shape[1]).astype(np.intp)
+    return mask[rows[:, None], cols]
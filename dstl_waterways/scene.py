@@ -0,0 +1,90 @@
+import os
+import numpy as np
+
+from dstl_waterways import profiling
+
+# Scene loader: the RGB, M, P and A products of one ImageId, each opened on
+# first access. Uncompressed TIFFs are memory-mapped, so only the pages that
+# are actually touched get read, and bands are handed out as views in the
+# file's own dtype (uint16) rather than as upcast copies.
+
+# product -> (directory, file name pattern)
+PRODUCTS = {
+    'RGB': ('three_band', '{}.tif'),       # (3, 3350, 3338)
+    'P': ('sixteen_band', '{}_P.tif'),     # (3349, 3338)
+    'M': ('sixteen_band', '{}_M.tif'),     # (8, 838, 835)
+    'A': ('sixteen_band', '{}_A.tif'),     # (8, 134, 133)
+}
+
+
+def open_tiff(path):
+    # memory-map uncompressed TIFFs so that windows are only read on access;
+    # compressed files cannot be mapped and have to be decoded whole
+    import tifffile as tiff
+    try:
+        return tiff.memmap(path, mode='r')
+    except ValueError:
+        return tiff.imread(path)
+
+
+class Scene(object):
+
+    def __init__(self, image_id, data_dir='.', catalog=None):
+        # catalog: an optional catalog.Catalog, to map products from their
+        # stored offsets instead of parsing the TIFF headers
+        self.image_id = image_id
+        self.data_dir = data_dir
+        self.catalog = catalog
+        self._products = {}
+
+    def path(self, product):
+        directory, pattern = PRODUCTS[product]
+        return os.path.join(self.data_dir, directory, pattern.format(self.image_id))
+
+    def identity(self, product):
+        # (path, size, mtime) of a product's file, for keying cached results
+        path = self.path(product)
+        st = os.stat(path)
+        return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+    def product(self, product):
+        # the whole product as stored, (bands, rows, cols) or (rows, cols)
+        if product not in self._products:
+            data = None
+            if self.catalog is not None:
+                data = self.catalog.open(self.image_id, product, self.path(product))
+            self._products[product] = open_tiff(self.path(product)) if data is None else data
+        return self._products[product]
+
+    def load(self, products=('RGB', 'P', 'M', 'A')):
+        # reads the products into memory now rather than page by page on
+        # access, e.g. in a prefetch thread (see prefetch.py); returns self
+        for product in products:
+            with profiling.stage('read_' + product, image_id=self.image_id):
+                self._products[product] = np.array(self.product(product))
+        return self
+
+    def band(self, product, band):
+        # one band as a 2-D view; band is a WV3 enum member or band number
+        return self.product(product)[getattr(band, 'value', band)]
+
+    @property
+    def rgb(self):
+        # (3350, 3338, 3) i.e. (row, col, colour) view of the (colour, row, col) file
+        return np.moveaxis(self.product('RGB'), 0, -1)
+
+    @property
+    def m(self):
+        return self.product('M')
+
+    @property
+    def p(self):
+        return self.product('P')
+
+    @property
+    def a(self):
+        return self.product('A')
+
+    def close(self):
+        # drops the maps; views handed out earlier keep their file open
+        self._products.clear()
@@ -0,0 +1,83 @@
+import numpy as np
+
+# Contrast enhancement as per QGIS Stretch to MinMax with 2% / 98% cut points.
+#
+# WorldView-3 bands are 11 bit (stored as 16 bit) integers, so the cut points
+# come from one bincount histogram per channel rather than two np.percentile
+# calls (each a full partition of the band), and the stretch itself is a
+# lookup table applied to every channel in a single indexing operation.
+
+
+def _lerp(a, b, t):
+    # the interpolation np.percentile uses, so the cut points match it exactly
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def histogram_percentiles(counts, percents):
+    # percentiles (linear interpolation, like np.percentile) of the data a
+    # bincount histogram was built from, along the last axis of counts
+    cum = np.cumsum(counts, axis=-1)
+    n = cum[..., -1:]
+    rank = (n - 1) * (np.asarray(percents, dtype=np.float64) / 100)
+    lo = np.floor(rank)
+    # the value at 0-based rank k is the first bin whose cumulative count exceeds k
+    value_lo = (cum[..., None, :] <= lo[..., None]).sum(axis=-1)
+    value_hi = (cum[..., None, :] <= np.minimum(lo + 1, n - 1)[..., None]).sum(axis=-1)
+    return _lerp(value_lo.astype(np.float64), value_hi.astype(np.float64), rank - lo)
+
+
+def _use_histogram(bands):
+    return bands.dtype.kind in 'u' and bands.dtype.itemsize <= 2
+
+
+def cut_points(bands, lower_percent=2, higher_percent=98, axis=-1):
+    # (lower, higher) cut points per channel, each of shape (channels,);
+    # bands is 2-D for a single band or 3-D with the channels along axis
+    bands = np.asarray(bands)
+    if bands.ndim == 2:
+        bands = bands[..., None]
+        axis = -1
+    channels = np.moveaxis(bands, axis, -1)
+
+    if _use_histogram(bands):
+        size = int(channels.max()) + 1
+        counts = np.stack([np.bincount(channels[..., i].ravel(), minlength=size)
+                           for i in range(channels.shape[-1])])
+        cuts = histogram_percentiles(counts, [lower_percent, higher_percent])
+    else:
+        cuts = np.percentile(channels, [lower_percent, higher_percent], axis=(0, 1)).T
+    return cuts[:, 0], cuts[:, 1]
+
+
+def stretch(bands, lower_percent=2, higher_percent=98, axis=-1, scale=1, dtype=np.float32):
+    # stretch every channel so its cut points map to 0 and scale, clipped to
+    # [0, scale] and returned as dtype; integer dtypes truncate, as the
+    # original np.zeros_like(bands) based versions did
+    bands = np.asarray(bands)
+    single = bands.ndim == 2
+    channels = bands[..., None] if single else np.moveaxis(bands, axis, -1)
+    c, d = cut_points(channels, lower_percent, higher_percent)
+
+    if _use_histogram(bands):
+        # one table row per channel: value -> stretched value
+        values = np.arange(int(channels.max()) + 1, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lut = (values[None, :] - c[:, None]) * scale / (d - c)[:, None]
+        lut = np.clip(lut, 0, scale).astype(dtype)
+        out = lut[np.arange(channels.shape[-1]), channels]
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out = np.clip((channels - c) * scale / (d - c), 0, scale).astype(dtype)
+
+    return out[..., 0] if single else np.moveaxis(out, -1, axis)
+
+
+def stretch_01(bands, lower_percent=2, higher_percent=98, axis=-1):
+    # float32 in 0 .. 1, for imshow
+    return stretch(bands, lower_percent, higher_percent, axis, scale=1, dtype=np.float32)
+
+
+def stretch_uint8(bands, lower_percent=2, higher_percent=98, axis=-1):
+    # convert 16 bit to 8 bit image, 0 .. 255
+    return stretch(bands, lower_percent, higher_percent, axis, scale=255, dtype=np.uint8)
@@ -0,0 +1,210 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from dstl_waterways import masks, profiling
+from dstl_waterways.catalog import load_catalog
+from dstl_waterways.diskcache import DiskCache
+from dstl_waterways.evaluate import GroundTruth, _scores
+from dstl_waterways.indices import INDICES
+from dstl_waterways.pipeline import PIPELINE, products_for
+from dstl_waterways.prefetch import prefetch_scenes
+
+# Threshold sweep: instead of thresholding every index once per candidate
+# value, each index raster is binned once into a joint histogram of (index
+# value, ground-truth label). Cumulative sums of the two label columns then
+# give tp / fp / fn for every bin edge as a threshold at once, so a sweep
+# over the whole dataset costs one pass over the pixels plus O(bins). Both
+# 'index > threshold' (NDWI, CCCI, high over water) and 'index < threshold'
+# (NDVI, EVI, SAVI, low over water) are scored, from the reverse and the
+# forward sums, and the better of the two is reported.
+#
+#   python sweep.py --data-dir . --out sweep
+#   python sweep.py --ids 6080_4_3 6120_2_2 --indices NDWI CCCI_SWIR --bins 800
+#
+# Thresholds are the bin edges, so they are exact to the bin width. The
+# opening / closing of the CCCI mask is not part of the sweep.
+
+# index -> range of the candidate thresholds
+SWEEP_RANGES = {
+    'NDWI': (-1, 1),
+    'NDVI': (-1, 1),
+    'EVI': (-2, 2),
+    'SAVI': (-1.5, 1.5),
+    'CCCI_NIR2': (-6, 6),
+    'CCCI_SWIR': (0, 2),
+    'FAUX_CCCI': (-1, 1),
+}
+DEFAULT_BINS = 400
+
+# index -> current value of the 'index > threshold' masks that use it
+CURRENT_THRESHOLDS = {
+    'NDWI': masks.NDWI_THRESHOLD,
+    'FAUX_CCCI': masks.FAUX_CCCI_THRESHOLD,
+    'CCCI_SWIR': masks.CCCI_SWIR_THRESHOLD,
+}
+
+
+class JointHistogram(object):
+    # counts of pixels per (index bin, label); bin 0 and bin bins + 1 hold
+    # the values below and above the range
+
+    def __init__(self, value_range, bins=DEFAULT_BINS):
+        self.range = value_range
+        self.bins = bins
+        self.edges = np.linspace(value_range[0], value_range[1], bins + 1)
+        self.counts = np.zeros((bins + 2, 2), dtype=np.int64)
+
+    def add(self, values, labels):
+        # values: index raster, labels: bool raster of the same shape
+        lo, hi = self.range
+        pos = (np.asarray(values, dtype=np.float64).ravel() - lo) * (self.bins / float(hi - lo))
+        # floor + 1 puts [edge i, edge i+1) in bin i + 1
+        idx = np.clip(np.floor(pos), -1, self.bins).astype(np.intp) + 1
+        idx *= 2
+        idx += np.asarray(labels, dtype=bool).ravel()
+        self.counts += np.bincount(idx, minlength=2 * (self.bins + 2)).reshape(-1, 2)
+
+    def merge(self, other):
+        if other.range != self.range or other.bins != self.bins:
+            raise ValueError('cannot merge histograms with different bins')
+        self.counts += other.counts
+        return self
+
+    def curve(self, direction='>'):
+        # tp, fp, fn of the mask 'index > edge' (or 'index < edge' with
+        # direction '<') for every edge
+        if direction == '>':
+            above = np.cumsum(self.counts[::-1], axis=0)[::-1]
+            tp, fp, total = above[1:, 1], above[1:, 0], above[0, 1]
+        elif direction == '<':
+            below = np.cumsum(self.counts, axis=0)
+            tp, fp, total = below[:-1, 1], below[:-1, 0], below[-1, 1]
+        else:
+            raise ValueError('direction {!r} is not one of > <'.format(direction))
+        return tp, fp, total - tp
+
+    def band_curve(self):
+        # tp, fp, fn of 'not lower < index < upper' for every pair of edges
+        # lower < upper, as (bins + 1, bins + 1) arrays indexed [lower, upper];
+        # pairs with lower >= upper are left at inside = 0
+        below = np.concatenate([np.zeros((1, 2), dtype=np.int64), np.cumsum(self.counts, axis=0)])
+        k = np.arange(self.bins + 1)
+        inside = below[k + 1][None, :, :] - below[k + 1][:, None, :]
+        inside[k[:, None] >= k[None, :]] = 0
+        total = below[-1]
+        tp = total[1] - inside[..., 1]
+        fp = total[0] - inside[..., 0]
+        return tp, fp, total[1] - tp
+
+
+def _ratio(a, b):
+    return np.where(b > 0, a / np.maximum(b, 1).astype(np.float64), 1.0)
+
+
+def pr_curve(hist, direction='>'):
+    # threshold, tp, fp, fn, precision, recall and jaccard of every edge
+    tp, fp, fn = hist.curve(direction)
+    return {'direction': direction, 'threshold': hist.edges, 'tp': tp, 'fp': fp, 'fn': fn,
+            'precision': _ratio(tp, tp + fp), 'recall': _ratio(tp, tp + fn),
+            'jaccard': _ratio(tp, tp + fp + fn)}
+
+
+def best_curve(hist):
+    # the pr_curve of the direction ('>' or '<') reaching the higher Jaccard index
+    curves = [pr_curve(hist, direction) for direction in ('>', '<')]
+    return max(curves, key=lambda curve: curve['jaccard'].max())
+
+
+def best_threshold(hist):
+    # (direction, threshold, scores) maximising the Jaccard index over all
+    # images, of either direction
+    curve = best_curve(hist)
+    i = int(np.argmax(curve['jaccard']))
+    return (curve['direction'], curve['threshold'][i],
+            _scores(int(curve['tp'][i]), int(curve['fp'][i]), int(curve['fn'][i])))
+
+
+def best_band(hist):
+    # (lower, upper, scores) of the CCCI style 'outside (lower, upper)' mask
+    tp, fp, fn = hist.band_curve()
+    jaccard = _ratio(tp, tp + fp + fn)
+    lower, upper = np.unravel_index(np.argmax(jaccard), jaccard.shape)
+    return (hist.edges[lower], hist.edges[upper],
+            _scores(int(tp[lower, upper]), int(fp[lower, upper]), int(fn[lower, upper])))
+
+
+def sweep(image_ids, indices=INDICES, truth=None, class_type=7, bins=DEFAULT_BINS, data_dir='.', prefetch=2,
+          disk_cache=None, catalog=None):
+    # one JointHistogram per index, accumulated over the images; the next
+    # prefetch scenes are read in the background while one is binned, and
+    # index rasters are reused from disk_cache (a diskcache.DiskCache) if given
+    hists = {name: JointHistogram(SWEEP_RANGES[name], bins) for name in indices}
+    scenes = prefetch_scenes(image_ids, data_dir, products_for(indices), depth=prefetch, catalog=catalog)
+    for image_id, scene in scenes:
+        with profiling.stage('image', image_id=image_id):
+            outputs = PIPELINE.evaluate(list(indices), {'scene': scene}, {'disk_cache': disk_cache})
+            for name in indices:
+                index = outputs[name]
+                with profiling.stage('truth'):
+                    labels = truth.mask(image_id, class_type, index.shape).to_bool()
+                with profiling.stage('sweep_hist'):
+                    hists[name].add(index, labels)
+    return hists
+
+
+def write_curve(path, curve):
+    # one row per threshold, direction the mask's comparison ('>' or '<')
+    columns = ('threshold', 'tp', 'fp', 'fn', 'precision', 'recall', 'jaccard')
+    with open(path, 'w') as f:
+        f.write(','.join(('direction',) + columns) + '\n')
+        for row in zip(*[curve[c] for c in columns]):
+            f.write('{},{:.6g},{},{},{},{:.6f},{:.6f},{:.6f}\n'.format(curve['direction'], *row))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep index thresholds against the training polygons.')
+    parser.add_argument('--ids', nargs='+', help='images to sweep over (default: all with the class)')
+    parser.add_argument('--indices', nargs='+', default=list(INDICES), choices=INDICES)
+    parser.add_argument('--class-type', type=int, default=7)
+    parser.add_argument('--bins', type=int, default=DEFAULT_BINS, help='candidate thresholds per index')
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--csv', default='train_wkt_v4.csv')
+    parser.add_argument('--grid-sizes', default='grid_sizes.csv')
+    parser.add_argument('--cache-dir', default=None, help='keep rasterized ground truth here')
+    parser.add_argument('--out', default=None, help='write <index>_pr.csv curves here')
+    parser.add_argument('--prefetch', type=int, default=2, help='scenes read ahead in the background (0: none)')
+    parser.add_argument('--disk-cache', metavar='DIR', default=None, help='reuse index rasters kept here')
+    parser.add_argument('--catalog', metavar='PATH', default=None, help='dataset catalog to open the scenes with')
+    args = parser.parse_args(argv)
+
+    truth = GroundTruth(args.csv, args.grid_sizes, args.cache_dir)
+    catalog = load_catalog(args.catalog) if args.catalog else None
+    image_ids = args.ids or truth.image_ids(args.class_type)
+    disk_cache = DiskCache(args.disk_cache) if args.disk_cache else None
+    hists = sweep(image_ids, args.indices, truth, args.class_type, args.bins, args.data_dir, args.prefetch,
+                  disk_cache, catalog)
+
+    print('{:<10} {:>4} {:>10} {:>8} {:>9} {:>7} {:>10}'.format(
+        'index', 'mask', 'threshold', 'jaccard', 'precision', 'recall', 'current'))
+    for name, hist in hists.items():
+        direction, threshold, s = best_threshold(hist)
+        current = CURRENT_THRESHOLDS.get(name)
+        print('{:<10} {:>4} {:>10.4f} {:>8.4f} {:>9.4f} {:>7.4f} {:>10}'.format(
+            name, direction, threshold, s['jaccard'], s['precision'], s['recall'],
+            '' if current is None else '> {}'.format(current)))
+        if args.out:
+            os.makedirs(args.out, exist_ok=True)
+            write_curve(os.path.join(args.out, name + '_pr.csv'), best_curve(hist))
+    if 'CCCI_NIR2' in hists:
+        lower, upper, s = best_band(hists['CCCI_NIR2'])
+        print('CCCI_NIR2 outside ({:.4f}, {:.4f}): jaccard {:.4f} precision {:.4f} recall {:.4f}'
+              ' (current {}, {})'.format(lower, upper, s['jaccard'], s['precision'], s['recall'],
+                                         masks.CCCI_THRESHOLD_L, masks.CCCI_THRESHOLD_U))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import numpy as np
+
+from dstl_waterways.bands import WV3ms, WV3swir
+from dstl_waterways.indices import NEEDS_RGB, NEEDS_SWIR, Workspace, compute_indices
+from dstl_waterways.masks import MASKS, MORPHOLOGY_HALO, compute_masks, mask_indices
+from dstl_waterways.scene import Scene
+
+# Windowed processing: a scene is processed in tiles with a halo of extra
+# pixels on every side, so the morphology in the masks sees the same
+# neighbourhood it would on the full scene and the assembled masks are
+# seam-free. Only the tile (plus halo) of each band is ever read, so peak
+# memory follows the tile size rather than the scene size.
+
+DEFAULT_TILE = 512
+
+
+def windows(shape, tile=DEFAULT_TILE, halo=MORPHOLOGY_HALO):
+    # yields (padded, core, dest) for each tile of a (rows, cols) grid:
+    #   padded - window to read, i.e. the tile grown by halo and clipped to the grid
+    #   core   - the tile within the padded window
+    #   dest   - the tile within the grid
+    rows, cols = shape
+    for r0 in range(0, rows, tile):
+        r1 = min(r0 + tile, rows)
+        pr0, pr1 = max(r0 - halo, 0), min(r1 + halo, rows)
+        for c0 in range(0, cols, tile):
+            c1 = min(c0 + tile, cols)
+            pc0, pc1 = max(c0 - halo, 0), min(c1 + halo, cols)
+            yield ((slice(pr0, pr1), slice(pc0, pc1)),
+                   (slice(r0 - pr0, r1 - pr0), slice(c0 - pc0, c1 - pc0)),
+                   (slice(r0, r1), slice(c0, c1)))
+
+
+def value_range(band, preserve_range=True):
+    # (min, max) of a band, in the units resize_window works in
+    from skimage.util import img_as_float
+    lo_hi = np.array([np.min(band), np.max(band)], dtype=band.dtype)
+    return tuple(lo_hi.astype(np.float64) if preserve_range else img_as_float(lo_hi))
+
+
+def resize_window(band, out_shape, window, preserve_range=True, clip=None):
+    # bilinear resize of a 2-D band to out_shape, evaluated on the (row slice,
+    # col slice) window of the output only. Gives the same values as
+    # skimage.transform.resize(band, out_shape, mode='constant') while reading
+    # just the part of band under the window. resize clips to the value range
+    # of the whole band, pass it as clip (see value_range) when resizing many
+    # windows of the same band.
+    from scipy import ndimage
+    from skimage.util import img_as_float
+    in_rows, in_cols = band.shape
+    r = (np.arange(window[0].start, window[0].stop) + 0.5) * (in_rows / out_shape[0]) - 0.5
+    c = (np.arange(window[1].start, window[1].stop) + 0.5) * (in_cols / out_shape[1]) - 0.5
+
+    # input block under the window, plus the neighbour each sample interpolates with
+    ir0, ir1 = max(int(np.floor(r[0])), 0), min(int(np.floor(r[-1])) + 2, in_rows)
+    ic0, ic1 = max(int(np.floor(c[0])), 0), min(int(np.floor(c[-1])) + 2, in_cols)
+    block = np.asarray(band[ir0:ir1, ic0:ic1])
+    block = block.astype(np.float64) if preserve_range else img_as_float(block)
+
+    rr, cc = np.meshgrid(r - ir0, c - ic0, indexing='ij')
+    out = ndimage.map_coordinates(block, [rr, cc], order=1, mode='grid-constant')
+    if clip is None:
+        clip = value_range(band, preserve_range)
+    return np.clip(out, clip[0], clip[1], out=out)
+
+
+def _tile_out(workspace, indices, shape):
+    # index arrays of a tile, only read until the next tile replaces them
+    return {name: workspace.get(('tile', name), shape) for name in indices}
+
+
+def process_tiled(image_id, masks=MASKS, tile=DEFAULT_TILE, halo=MORPHOLOGY_HALO, data_dir='.',
+                  histograms=None, workspace=None, catalog=None):
+    # returns {mask name: bool raster}, FAUX_CCCI on the RGB grid and the rest on the M grid
+    # histograms: optional {index name: histogram.Histogram}, updated with the
+    # core of every tile, so the index rasters are binned but never held whole
+    # workspace: indices.Workspace reused by every tile, and by later calls
+    # catalog: optional catalog.Catalog the scene is opened through
+    histograms = histograms or {}
+    workspace = workspace or Workspace()
+    indices = mask_indices(masks)
+    indices += [name for name in histograms if name not in indices]
+    ms_indices = [name for name in indices if name not in NEEDS_RGB]
+    rgb_indices = [name for name in indices if name in NEEDS_RGB]
+
+    scene = Scene(image_id, data_dir, catalog)
+    m = scene.m
+    ms_shape = m.shape[1:]
+    out = {}
+
+    if ms_indices:
+        ms_masks = [name for name in masks if name not in NEEDS_RGB]
+        swir1 = None
+        if any(name in NEEDS_SWIR for name in ms_indices):
+            swir1 = np.asarray(scene.band('A', WV3swir.SWIR_1))
+            swir1_range = value_range(swir1)
+        for name in ms_masks:
+            out[name] = np.zeros(ms_shape, dtype=bool)
+
+        for padded, core, dest in windows(ms_shape, tile, halo):
+            msdata = np.asarray(m[(slice(None),) + padded])
+            resampled = {}
+            if swir1 is not None:
+                resampled['SWIR1'] = resize_window(swir1, ms_shape, padded, clip=swir1_range).astype(np.float32)
+            tile_indices = compute_indices(msdata, ms_indices, resampled=resampled, workspace=workspace,
+                                           out=_tile_out(workspace, ms_indices, msdata.shape[1:]))
+            tile_masks = compute_masks(tile_indices, ms_masks)
+            for name in ms_masks:
+                out[name][dest] = tile_masks[name][core]
+            for name in ms_indices:
+                if name in histograms:
+                    histograms[name].update(tile_indices[name][core])
+
+    if rgb_indices:
+        rgb_masks = [name for name in masks if name in NEEDS_RGB]
+        rgb = scene.product('RGB')
+        rgb_shape = rgb.shape[1:]
+        for name in rgb_masks:
+            out[name] = np.zeros(rgb_shape, dtype=bool)
+        # the M bands are 1/16 of the RGB grid, so these two are read whole
+        RE = np.asarray(scene.band('M', WV3ms.REDEDGE))
+        NIR2 = np.asarray(scene.band('M', WV3ms.NEARIR2))
+        RE_range = value_range(RE, preserve_range=False)
+        NIR2_range = value_range(NIR2, preserve_range=False)
+
+        for padded, core, dest in windows(rgb_shape, tile, halo):
+            # (colour, row, col) -> (row, col, colour)
+            rgbdata = np.rollaxis(np.asarray(rgb[(slice(None),) + padded]), 0, 3)
+            resampled = {
+                'RE_RGB': resize_window(RE, rgb_shape, padded, preserve_range=False,
+                                        clip=RE_range).astype(np.float32),
+                'NIR2_RGB': resize_window(NIR2, rgb_shape, padded, preserve_range=False,
+                                          clip=NIR2_range).astype(np.float32),
+            }
+            tile_indices = compute_indices(None, rgb_indices, rgbdata=rgbdata, resampled=resampled,
+                                           workspace=workspace,
+                                           out=_tile_out(workspace, rgb_indices, rgbdata.shape[:2]))
+            tile_masks = compute_masks(tile_indices, rgb_masks)
+            for name in rgb_masks:
+                out[name][dest] = tile_masks[name][core]
+            for name in rgb_indices:
+                if name in histograms:
+                    histograms[name].update(tile_indices[name][core])
+
+    return out
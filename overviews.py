@@ -0,0 +1,8 @@
+import sys
+
+from dstl_waterways.overviews import main
+
+# command line entry point, see dstl_waterways/overviews.py
+
+if __name__ == '__main__':
+    sys.exit(main())
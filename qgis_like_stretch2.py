@@ -1,29 +1,25 @@
-import numpy as np
-import tifffile as tiff
-import matplotlib.pyplot as plt
+from dstl_waterways.overviews import overview
+from dstl_waterways.scene import Scene
 
 
-def stretchToMinMax(bands, lower_percent=2, higher_percent=98):
-    # contrast enhancement as per QGIS Stretch to MinMax
-    # and rescale in 0 .. 255
-    out = np.zeros_like(bands)
-    for i in range(3):
-        a = 0
-        b = 255
-        c = np.percentile(bands[i, :, :], lower_percent)
-        d = np.percentile(bands[i, :, :], higher_percent)
-        t = a + (bands[i, :, :] - c) * (b - a) / (d - c)
-        t[t < a] = a
-        t[t > b] = b
-        out[i, :, :] = t
-    return out
+def main(image_id='6070_2_3'):
+    import tifffile as tiff
+    import matplotlib.pyplot as plt
 
-# tifffile RGB = ndarray shape (3, 3350, 3338) i.e. (colour, row, col)
-# [0] = red, [1] = green, [2] = blue, 16 bit depth
-tifffile_rgb = tiff.imread('three_band/6070_2_3.tif')
+    # tifffile RGB = ndarray shape (3, 3350, 3338) i.e. (colour, row, col)
+    # [0] = red, [1] = green, [2] = blue, 16 bit depth
+    scene = Scene(image_id)
 
-# display
-fig, axes_subplot, axes_image = tiff.imshow(stretchToMinMax(tifffile_rgb), title="RGB", bitspersample=16, photometric='rgb')
+    # display
+    # contrast enhancement as per QGIS Stretch to MinMax, rescaled to 0 .. 255,
+    # read from the overview pyramid at the level that fills a 800x800 window
+    # (built on first use in the data directory's overviews/, see dstl_waterways/overviews.py)
+    rgb = overview(scene, 'RGB', viewport=(800, 800))
+    fig, axes_subplot, axes_image = tiff.imshow(rgb, title="RGB", photometric='rgb')
 
-axes_image.axes.axis('off')
-plt.show()
+    axes_image.axes.axis('off')
+    plt.show()
+
+
+if __name__ == '__main__':
+    main()
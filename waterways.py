@@ -1,122 +1,139 @@
 import numpy as np
-import tifffile as tiff
-import matplotlib.pyplot as plt
-from skimage.transform import resize
-import pandas as pd
-from enum import Enum
-
-# Worldview-3 - 8 Multispectral:
-# Coastal: 400 - 450 nm (0, QGIS: 1, WV-3-Band-no:2)     Red: 630 - 690 nm       (4, QGIS: 5, WV-3-Band-no:6)
-# Blue: 450 - 510 nm    (1, QGIS: 2, WV-3-Band-no:3)     Red Edge: 705 - 745 nm  (5, QGIS: 6, WV-3-Band-no:7)
-# Green: 510 - 580 nm   (2, QGIS: 3, WV-3-Band-no:4)     Near-IR1: 770 - 895 nm  (6, QGIS: 7, WV-3-Band-no:8)
-# Yellow: 585 - 625 nm  (3, QGIS: 4, WV-3-Band-no:5)     Near-IR2: 860 - 1040 nm (7, QGIS: 8, WV-3-Band-no:9)
-
-
-class WV3ms(Enum):
-    COASTAL = 0
-    BLUE = 1
-    GREEN = 2
-    YELLOW = 3
-    RED = 4
-    REDEDGE = 5
-    NIR1 = 6
-    NIR2 = 7
+
+from dstl_waterways import profiling
+from dstl_waterways.bands import WV3ms
+from dstl_waterways.batch import WATERWAY_TEST, select_image_ids
+from dstl_waterways.indices import grid_shape
+from dstl_waterways.overviews import overview
+from dstl_waterways.prefetch import prefetch_scenes
+from dstl_waterways.resample import block_mean, resize_band
+from dstl_waterways.scene import Scene
+
+# Worldview-3 band layout and sensor shapes: see dstl_waterways/bands.py
 
 
 CCCI_THRESHOLD_RGB = 0.11
 CCCI_THRESHOLD_MS = 0.35
 
+# grid the indices are computed on, see indices.RESOLUTIONS: 'ms' keeps the
+# M bands as they are and averages the RGB red band down to them, 'rgb'
+# upsamples the M bands 16x to the RGB grid
+RESOLUTION = 'ms'
+
+
+# the M bands the indices below use
+INDEX_BANDS = (WV3ms.GREEN, WV3ms.RED, WV3ms.REDEDGE, WV3ms.NEARIR1, WV3ms.NEARIR2)
+
+
+def _ms_band(image_id, msdata, band, shape):
+    # an M band on the grid in float32, scaled to [0, 1] as resize() leaves it
+    if shape == msdata.shape[1:]:
+        return np.divide(msdata[band.value, :, :], 65535.0, dtype=np.float32)
+    return resize_band(image_id, 'M', band, msdata[band.value, :, :], shape, dtype=np.float32,
+                       work_dtype=np.float32, mode='constant')
+
 
-def stretch_8bit(bands, lower_percent=2, higher_percent=98):
-    # contrast enhancement as per QGIS Stretch to MinMax
-    # note that input image range is 0 .. 1
-    out = np.zeros_like(bands).astype(np.float32)
-    for i in range(3):
-        a = 0
-        b = 1
-        c = np.percentile(bands[:, :, i], lower_percent)
-        d = np.percentile(bands[:, :, i], higher_percent)
-        t = a + (bands[:, :, i] - c) * (b - a) / (d - c)
-        t[t < a] = a
-        t[t > b] = b
-        out[:, :, i] = t
-    return out.astype(np.float32)
-
-
-def CCCI_index_rgb(msdata, rgbdata):
-    RE = resize(msdata[WV3ms.REDEDGE.value, :, :], (rgbdata.shape[0], rgbdata.shape[1]), mode='constant')
-    NIR = resize(msdata[WV3ms.NIR2.value, :, :], (rgbdata.shape[0], rgbdata.shape[1]), mode='constant')
+def ms_bands(image_id, msdata, shape, bands=INDEX_BANDS):
+    # {band: _ms_band}, each band converted once and passed to every index
+    return {band: _ms_band(image_id, msdata, band, shape) for band in bands}
+
+
+def _band(bands, image_id, msdata, band, shape):
+    # band from ms_bands if it was given, converted here otherwise
+    if bands is not None and band in bands:
+        return bands[band]
+    return _ms_band(image_id, msdata, band, shape)
+
+
+def _rgb_red(rgbdata, shape):
     R = rgbdata[:, :, 0]
+    return R if shape == R.shape else block_mean(R, shape)
+
+
+def CCCI_index_rgb(msdata, rgbdata, image_id=None, shape=None, bands=None):
+    shape = shape or (rgbdata.shape[0], rgbdata.shape[1])
+    RE = _band(bands, image_id, msdata, WV3ms.REDEDGE, shape)
+    NIR = _band(bands, image_id, msdata, WV3ms.NEARIR2, shape)
+    R = _rgb_red(rgbdata, shape)
     # R = resize(rgbdata[:, :, 0], (rgbdata.shape[0], rgbdata.shape[1]))
     # Canopy Chlorophyll Content Index
     CCCI = ((NIR - RE) / (NIR + RE)) / ((NIR - R) / (NIR + R))
     return CCCI
 
 
-def CCCI_index_ms(msdata, rgbdata):
-    RE = resize(msdata[WV3ms.REDEDGE.value, :, :], (rgbdata.shape[0], rgbdata.shape[1]), mode='constant')
-    NIR = resize(msdata[WV3ms.NIR2.value, :, :], (rgbdata.shape[0], rgbdata.shape[1]), mode='constant')
-    R = resize(msdata[WV3ms.RED.value, :, :], (rgbdata.shape[0], rgbdata.shape[1]), mode='constant')
+def CCCI_index_ms(msdata, rgbdata, image_id=None, shape=None, bands=None):
+    shape = shape or (rgbdata.shape[0], rgbdata.shape[1])
+    RE = _band(bands, image_id, msdata, WV3ms.REDEDGE, shape)
+    NIR = _band(bands, image_id, msdata, WV3ms.NEARIR2, shape)
+    R = _band(bands, image_id, msdata, WV3ms.RED, shape)
     # Canopy Chlorophyll Content Index
     CCCI = ((NIR - RE) / (NIR + RE)) / ((NIR - R) / (NIR + R))
     return CCCI
 
 
-def NVWI_index(msdata, rgbdata):
-    G = resize(msdata[WV3ms.GREEN.value, :, :], (rgbdata.shape[0], rgbdata.shape[1]), mode='constant')
-    NIR = resize(msdata[WV3ms.NIR1.value, :, :], (rgbdata.shape[0], rgbdata.shape[1]), mode='constant')
+def NVWI_index(msdata, rgbdata, image_id=None, shape=None, bands=None):
+    shape = shape or (rgbdata.shape[0], rgbdata.shape[1])
+    G = _band(bands, image_id, msdata, WV3ms.GREEN, shape)
+    NIR = _band(bands, image_id, msdata, WV3ms.NEARIR1, shape)
     NVWI = (G - NIR) / (G + NIR)
     return NVWI
 
 
-def display(IM_ID):
-    # read rgb and m bands
-    rgb = tiff.imread('three_band/{}.tif'.format(IM_ID))
-    rgb = np.rollaxis(rgb, 0, 3)
-    m = tiff.imread('sixteen_band/{}_M.tif'.format(IM_ID))
+def display(IM_ID, scene=None):
+    import matplotlib.pyplot as plt
+
+    # rgb and m bands, memory-mapped unless a scene already read into memory is passed in
+    scene = scene or Scene(IM_ID)
+    rgb = scene.rgb
+    m = scene.m
 
     # get our indices
-    myCCCI_rgb = CCCI_index_rgb(m, rgb)
-    myCCCI_ms = CCCI_index_ms(m, rgb)
-    myNDWI = NVWI_index(m, rgb)
+    # every M band is converted (or upsampled) once, in float32, and shared by all three
+    shape = grid_shape(RESOLUTION, m.shape[1:], rgb.shape[:2])
+    with profiling.stage('indices', image_id=IM_ID):
+        bands = ms_bands(IM_ID, m, shape)
+        myCCCI_rgb = CCCI_index_rgb(m, rgb, IM_ID, shape, bands)
+        myCCCI_ms = CCCI_index_ms(m, rgb, IM_ID, shape, bands)
+        myNDWI = NVWI_index(m, rgb, IM_ID, shape, bands)
 
     # you can look on histogram and pick your favorite threshold value
     ccci_binary_rgb = (myCCCI_rgb > CCCI_THRESHOLD_RGB).astype(np.float32)
     ccci_binary_ms = (myCCCI_ms > CCCI_THRESHOLD_MS).astype(np.float32)
 
-    fig, axes = plt.subplots(ncols=5, nrows=1, figsize=(16, 4))
-    ax = axes.ravel()
-    ax[0].imshow(stretch_8bit(rgb))
-    ax[0].set_title('Image')
-    ax[0].axis('off')
-    ax[1].imshow(myCCCI_ms, vmin=-.5, vmax=.5)
-    ax[1].set_title('CCCI')
-    ax[1].axis('off')
-    ax[2].imshow(ccci_binary_rgb, cmap='binary_r')
-    ax[2].set_title('CCCI - RGB Red')
-    ax[2].axis('off')
-    ax[3].imshow(ccci_binary_ms, cmap='binary_r')
-    ax[3].set_title('CCCI - Multispectral Red')
-    ax[3].axis('off')
-    ax[4].imshow(myNDWI)
-    ax[4].set_title('NDWI')
-    ax[4].axis('off')
-    plt.tight_layout()
+    with profiling.stage('plot', image_id=IM_ID):
+        fig, axes = plt.subplots(ncols=5, nrows=1, figsize=(16, 4))
+        ax = axes.ravel()
+        # stretched RGB from the overview pyramid, 1/4 of the full size is plenty for this panel;
+        # the sidecar is built on first use in the data directory's overviews/
+        ax[0].imshow(overview(scene, 'RGB', viewport=(800, 800)))
+        ax[0].set_title('Image')
+        ax[0].axis('off')
+        ax[1].imshow(myCCCI_ms, vmin=-.5, vmax=.5)
+        ax[1].set_title('CCCI')
+        ax[1].axis('off')
+        ax[2].imshow(ccci_binary_rgb, cmap='binary_r')
+        ax[2].set_title('CCCI - RGB Red')
+        ax[2].axis('off')
+        ax[3].imshow(ccci_binary_ms, cmap='binary_r')
+        ax[3].set_title('CCCI - Multispectral Red')
+        ax[3].axis('off')
+        ax[4].imshow(myNDWI)
+        ax[4].set_title('NDWI')
+        ax[4].axis('off')
+        plt.tight_layout()
     plt.show()
 
 
-data = pd.read_csv('train_wkt_v4.csv')
-data = data[data.MultipolygonWKT != 'MULTIPOLYGON EMPTY']
+def main():
+    # use training data images for waterway
+    # the next images are read in the background while one is on screen
+    for IMG_ID, scene in prefetch_scenes(select_image_ids('train_wkt_v4.csv', 7), products=('M', 'RGB')):
+        display(IMG_ID, scene)
 
-# use training data images for waterway
-for IMG_ID in data[data.ClassType == 7].ImageId:
-    display(IMG_ID)
+    # test images
+    for IMG_ID, scene in prefetch_scenes(WATERWAY_TEST, products=('M', 'RGB')):
+        display(IMG_ID, scene)
 
-# test images
-# take some pictures from test
-waterway_test = ['6080_4_3', '6080_4_0',
-                 '6080_1_3', '6080_1_1',
-                 '6150_3_4', '6050_2_1']
 
-for IMG_ID in waterway_test:
-    display(IMG_ID)
+if __name__ == '__main__':
+    main()